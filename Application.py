@@ -6,14 +6,12 @@ from tkinter import *
 from tkinter import ttk
 from tkinter import scrolledtext
 import tkinter.font as tkFont
-from BSEuroOption import BSEuroOption
-from ImpliedVolatility import ImpliedVolatility
-from CFGeoAsianOption import GeoAsianOption
-from CFGeoBasketOption import CFGeoBasketOption
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 import math
-from MCArithAsianOption import MCArithAsianOption
-from MCArithBasketOption import MCArithBasketOption
-from BiTreeAmericanOption import BiTreeAmericanOption
+
+# the pricers (and numpy/scipy behind them) are imported by the task running them, so the window opens without them
 
 class Application:
     
@@ -24,11 +22,18 @@ class Application:
         self.window.geometry('%dx%d' % (700, 400))
         self.menubar = Menu(self.window)
 
+        # the Monte Carlo pricers run on a background thread, their progress is polled back into the logs
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job = None
+        self.cancel = threading.Event()
+        self.progress = queue.Queue()
+
         self.__createPage()
         self.__HomePage()
         self.__createMenu()
 
         self.window.config(menu=self.menubar)
+        self.window.protocol("WM_DELETE_WINDOW", self.Quit)
         
         self.__forgetFrame()
         self.frameHomePage.pack()  # Place frameHomePage into the window
@@ -320,7 +325,8 @@ class Application:
         rbPut = Radiobutton(frame, width=6, text="Put", bg="red", variable=self.option_type, value='put').grid(row=6, column=2, sticky=E)
         rbCall = Radiobutton(frame, width=6, text="Call", bg="yellow", variable=self.option_type, value='call').grid(row=6, column=3, sticky=W)
 
-        btRun = Button(frame, width=10, text="Run", command=self.run_task5).grid(row=7, column=1, columnspan=4)
+        btRun = Button(frame, width=10, text="Run", command=self.run_task5).grid(row=7, column=1, columnspan=2)
+        btCancel = Button(frame, width=10, text="Cancel", command=self.cancel_job).grid(row=7, column=3, columnspan=2)
 
         self.logs = scrolledtext.ScrolledText(frame, width = 74, height = 16)
         self.logs.grid(row=8, column=1, columnspan=4)
@@ -370,7 +376,8 @@ class Application:
         rbPut = Radiobutton(frame, text="Put", bg="red", variable=self.option_type, value='put').grid(row=7, column=2)
         rbCall = Radiobutton(frame, text="Call", bg="yellow", variable=self.option_type, value='call').grid(row=7, column=3)
 
-        btRun = Button(frame, width=10, text="Run", command=self.run_task6).grid(row=8, column=1, columnspan=4)
+        btRun = Button(frame, width=10, text="Run", command=self.run_task6).grid(row=8, column=1, columnspan=2)
+        btCancel = Button(frame, width=10, text="Cancel", command=self.cancel_job).grid(row=8, column=3, columnspan=2)
 
         self.logs = scrolledtext.ScrolledText(frame, height=14)
         self.logs.grid(row=9, column=1, columnspan=4)
@@ -418,6 +425,7 @@ class Application:
         
         # define run button to run the pricer
         btRun = Button(frame, width = 10, text = "Run", command = self.run_task7).grid(row = 9, column = 2, columnspan = 1, sticky = W)
+        btCancel = Button(frame, width = 10, text = "Cancel", command = self.cancel_job).grid(row = 9, column = 1, columnspan = 1, sticky = E)
         
         # define a window to display result
         self.logs = scrolledtext.ScrolledText(frame, width = 74, height = 12)
@@ -430,6 +438,7 @@ class Application:
         
     def run_task1(self):
         
+        from BSEuroOption import BSEuroOption
         OptionType = self.option_type.get()
         
         if OptionType == "Call Option":
@@ -475,6 +484,7 @@ class Application:
         
     def run_task2(self):
         
+        from ImpliedVolatility import ImpliedVolatility
         OptionType = self.option_type.get()
         
         if OptionType == "Call Option":
@@ -482,7 +492,7 @@ class Application:
             try:
   
                 instance = ImpliedVolatility(S = self.s0.get(), r = self.r.get(), q = self.q.get(), T = self.T.get(), K = self.K.get(), V = self.V.get())
-                result = instance.CallVolatility()
+                result = instance.CallVolatility(method = 'bracketed')
                 
                 if math.isnan(result) or math.isinf(result):
                     
@@ -501,7 +511,7 @@ class Application:
             try:
             
                 instance = ImpliedVolatility(S = self.s0.get(), r = self.r.get(), q = self.q.get(), T = self.T.get(), K = self.K.get(), V = self.V.get())
-                result = instance.PutVolatility()
+                result = instance.PutVolatility(method = 'bracketed')
                 
                 if math.isnan(result) or math.isinf(result):
                     
@@ -530,6 +540,7 @@ class Application:
         
     def run_task3(self):
         
+        from CFGeoAsianOption import GeoAsianOption
         OptionType = self.option_type.get()
         
         if OptionType == "Call Option":
@@ -585,6 +596,7 @@ class Application:
         
     def run_task4(self):
         
+        from CFGeoBasketOption import CFGeoBasketOption
         OptionType = self.option_type.get()
         
         if OptionType == "Call Option":
@@ -646,53 +658,92 @@ class Application:
         
     def run_task5(self):
         
-        self.logs.insert(END, "waiting.... [It may take you several minutes]\n")
+        from MCArithAsianOption import MCArithAsianOption
+        if self.job is not None and not self.job.done():
+            self.logs.insert(END, "A pricer is still running, wait for it or cancel it.\n")
+            return
+        self.logs.insert(END, "waiting.... [Cancel stops the simulation]\n")
 
+        # the inputs are read here, Tk variables must not be touched from the background thread
         option = MCArithAsianOption(s0=self.s0.get(), sigma=self.sigma.get(), r=self.r.get(),
                                     T=self.T.get(), K=self.K.get(), n=self.n.get(), m=self.m.get(), 
-                                    option_type=self.option_type.get(), ctrl_var=self.ctrl_var.get())
-        result, interval = option.pricing()
-        self.logs.insert(END, "The option premium is: {}\n".format(result))
-        # output the 95% confidence interval
-        self.logs.insert(END, "The 95% confidence interval is: {}\n\n".format(interval))
+                                    option_type=self.option_type.get(), ctrl_var=self.ctrl_var.get(),
+                                    progress=self.progress.put, progress_interval=0.5, cancel=self.cancel)
+        self.__submit(option.pricing, ["The option premium is: {}\n",
+                               # output the 95% confidence interval
+                               "The 95% confidence interval is: {}\n\n"])
 
     def run_task6(self):
         
-        self.logs.insert(END, "waiting.... [It may take you several minutes]\n\n")
+        from MCArithBasketOption import MCArithBasketOption
+        if self.job is not None and not self.job.done():
+            self.logs.insert(END, "A pricer is still running, wait for it or cancel it.\n")
+            return
+        self.logs.insert(END, "waiting.... [Cancel stops the simulation]\n\n")
 
         option = MCArithBasketOption(s0_1=self.s0_1.get() ,s0_2=self.s0_2.get(), sigma_1=self.sigma_1.get(),
                                      sigma_2=self.sigma_2.get(), r=self.r.get(), T=self.T.get(), K=self.K.get(),
                                      rho=self.rho.get(),option_type=self.option_type.get(),
-                                     ctrl_var=self.ctrl_var.get())
-        result, interval = option.pricing(num_randoms=self.m.get())
-        self.logs.insert(END, "The put option premium is: {}\n".format(result))
-        self.logs.insert(END, "The confidence interval is: {}\n".format(interval))
+                                     m=self.m.get(), ctrl_var=self.ctrl_var.get(),
+                                     progress=self.progress.put, progress_interval=0.5, cancel=self.cancel)
+        self.__submit(option.pricing, ["The {} option premium is: {{}}\n".format(option.option_type),
+                               "The confidence interval is: {}\n"])
+
+    def __submit(self, pricing, messages):
+
+        # price on the background thread and poll its progress from the Tk event loop;
+        # pricing returns the values printed with messages, one message per value
+        self.cancel.clear()
+        self.job = self.executor.submit(pricing)
+        self.window.after(100, self.__poll, self.job, self.logs, messages)
+
+    def __poll(self, job, logs, messages):
+
+        from MCEngine import SimulationCancelled
+        while not self.progress.empty():
+            info = self.progress.get()
+            logs.insert(END, "{:,} paths in {:.1f}s, estimate {:.6f}, CI width {:.6f}\n".format(
+                info['paths'], info['elapsed'], info['estimate'], info['ci_width']))
+            logs.see(END)
+        if not job.done():
+            self.window.after(100, self.__poll, job, logs, messages)
+            return
+
+        try:
+            for message, value in zip(messages, job.result()):
+                logs.insert(END, message.format(value))
+        except SimulationCancelled:
+            logs.insert(END, "The pricing was cancelled.\n\n")
+        except Exception:
+            # whatever the pricer raised on the worker thread, the window reports it instead of dropping it
+            logs.insert(END, "Input Parameter Error! Please input the correct parameters!\n\n")
+        logs.see(END)
+
+    def cancel_job(self):
+
+        if self.job is not None and not self.job.done():
+            self.cancel.set()
         
     def run_task7(self):
         
+        from BiTreeAmericanOption import BiTreeAmericanOption
         OptionType = self.option_type.get()
         
-        if OptionType == "Call Option":
+        if OptionType == "Call Option" or OptionType == "Put Option":
+            
+            if self.job is not None and not self.job.done():
+                self.logs.insert(END, "A pricer is still running, wait for it or cancel it.\n")
+                return
             
             try:
-  
-                option = BiTreeAmericanOption()
-                result = option.BiTreeAmericanOption(S0 = self.s0.get(), sigma = self.sigma.get(), r = self.r.get(), T = self.T.get(), K = self.K.get(), N = self.N.get(), option = 'call')
-                self.logs.insert(END, "The Call Option Premium is: {}\n".format(result))
-                
-            except ZeroDivisionError:
                 
-                self.logs.insert(END, "Input Parameter Error! Please input the correct parameters!\n")
+                # the inputs are read here, the lattice runs on the background thread so a large N keeps the window alive
+                inputs = dict(S0 = self.s0.get(), sigma = self.sigma.get(), r = self.r.get(), T = self.T.get(), K = self.K.get(), N = self.N.get(), option = OptionType.split()[0].lower(), cancel = self.cancel)
+                self.logs.insert(END, "waiting.... [Cancel stops the lattice]\n")
+                self.__submit(lambda: (BiTreeAmericanOption().BiTreeAmericanOption(**inputs),),
+                              ["The {} Premium is: {{}}\n".format(OptionType)])
                 
-        elif OptionType == "Put Option": 
-            
-            try:
-            
-                option = BiTreeAmericanOption()
-                result = option.BiTreeAmericanOption(S0 = self.s0.get(), sigma = self.sigma.get(), r = self.r.get(), T = self.T.get(), K = self.K.get(), N = self.N.get(), option = 'put')
-                self.logs.insert(END, "The Put Option Premium is: {}\n".format(result))
-            
-            except ZeroDivisionError:
+            except (ZeroDivisionError, ValueError):
                 
                 self.logs.insert(END, "Input Parameter Error! Please input the correct parameters!\n")
         
@@ -715,6 +766,9 @@ class Application:
         
     def Quit(self):
         
+        # the simulations and the lattice stop at the cancel event, so the window closes without waiting for them
+        self.cancel.set()
+        self.executor.shutdown(wait=False)
         self.window.destroy()
 
 if __name__ == '__main__':
@@ -4,7 +4,20 @@ Implement Black-Scholes Formulas for European Call/Put Option.
 """
 import math
 from math import e
-from scipy.stats import norm
+import numpy as np
+from SpecialFunctions import ncdf, npdf, ncdf_scalar
+
+# the sign of the payoff, +1 for the calls and -1 for the puts, for one option type or an array of them;
+# any other type is an error, the vectorized formulas would otherwise price it as a call
+def OptionSign(option):
+    
+    option = np.asarray(option)
+    IsPut = option == 'put'
+    if not np.all(IsPut | (option == 'call')):
+        raise ValueError("the option type is 'call' or 'put', got {}".format(
+            np.unique(option[~(IsPut | (option == 'call'))]).tolist()))
+    
+    return np.where(IsPut, -1.0, 1.0)
 
 class BSEuroOption:
     
@@ -19,8 +32,8 @@ class BSEuroOption:
         
         d1 = (math.log(S/K) + (r-q)*(T-t))/(sigma*math.sqrt(T-t)) + (1/2)*sigma*math.sqrt(T-t)
         d2 = (math.log(S/K) + (r-q)*(T-t))/(sigma*math.sqrt(T-t)) - (1/2)*sigma*math.sqrt(T-t)
-        N_d1 = norm.cdf(d1)
-        N_d2 = norm.cdf(d2)
+        N_d1 = ncdf_scalar(d1)
+        N_d2 = ncdf_scalar(d2)
         CallPremium = S*e**(-q*(T-t))*N_d1 - K*e**(-r*(T-t))*N_d2
         
         return CallPremium
@@ -29,9 +42,60 @@ class BSEuroOption:
         
         d1 = (math.log(S/K) + (r-q)*(T-t))/(sigma*math.sqrt(T-t)) + (1/2)*sigma*math.sqrt(T-t)
         d2 = (math.log(S/K) + (r-q)*(T-t))/(sigma*math.sqrt(T-t)) - (1/2)*sigma*math.sqrt(T-t)
-        Negative_N_d1 = norm.cdf(-d1)
-        Negative_N_d2 = norm.cdf(-d2)
+        Negative_N_d1 = ncdf_scalar(-d1)
+        Negative_N_d2 = ncdf_scalar(-d2)
         PutPremium = K*e**(-r*(T-t))*Negative_N_d2 - S*e**(-q*(T-t))*Negative_N_d1
         
         return PutPremium
-        
\ No newline at end of file
+
+    # price arrays of contracts at once; all inputs broadcast against each other
+    def CallAndPutOption(self, S, sigma, r, q, T, K, t = 0):
+        
+        S, sigma, r, q, T, K, t = (np.asarray(x, dtype = float) for x in (S, sigma, r, q, T, K, t))
+        
+        # d1/d2 are computed once and shared by the call and the put
+        SigmaSqrtTau = sigma*np.sqrt(T-t)
+        d1 = (np.log(S/K) + (r-q)*(T-t))/SigmaSqrtTau + (1/2)*SigmaSqrtTau
+        d2 = d1 - SigmaSqrtTau
+        DiscountedS = S*np.exp(-q*(T-t))
+        DiscountedK = K*np.exp(-r*(T-t))
+        
+        CallPremium = DiscountedS*ncdf(d1) - DiscountedK*ncdf(d2)
+        PutPremium = DiscountedK*ncdf(-d2) - DiscountedS*ncdf(-d1)
+        
+        return CallPremium, PutPremium
+    
+    # sensitivities of the Black formula on a forward F, discounted at r: the price, dV/dF, d2V/dF2,
+    # dV/dsigma and dV/dT holding F fixed; all inputs are arrays (or scalars) broadcast against each other
+    def BlackGreeks(self, F, sigma, r, T, K, option = 'call'):
+        
+        F, sigma, r, T, K = (np.asarray(x, dtype = float) for x in (F, sigma, r, T, K))
+        Phi = OptionSign(option)
+        
+        SigmaSqrtT = sigma*np.sqrt(T)
+        d1 = np.log(F/K)/SigmaSqrtT + (1/2)*SigmaSqrtT
+        d2 = d1 - SigmaSqrtT
+        Discount = np.exp(-r*T)
+        
+        Price = Discount*Phi*(F*ncdf(Phi*d1) - K*ncdf(Phi*d2))
+        DeltaF = Discount*Phi*ncdf(Phi*d1)
+        GammaF = Discount*npdf(d1)/(F*SigmaSqrtT)
+        Vega = Discount*F*npdf(d1)*np.sqrt(T)
+        DecayT = -r*Price + Discount*F*npdf(d1)*sigma/(2*np.sqrt(T))
+        
+        return Price, DeltaF, GammaF, Vega, DecayT
+    
+    # price, delta, gamma, vega, theta (per year of calendar time) and rho, for arrays of contracts
+    def Greeks(self, S, sigma, r, q, T, K, t = 0, option = 'call'):
+        
+        S, sigma, r, q, T, K, t = (np.asarray(x, dtype = float) for x in (S, sigma, r, q, T, K, t))
+        Tau = T - t
+        Growth = np.exp((r-q)*Tau)
+        Price, DeltaF, GammaF, Vega, DecayT = self.BlackGreeks(S*Growth, sigma, r, Tau, K, option)
+        
+        return {'price': Price,
+                'delta': DeltaF*Growth,
+                'gamma': GammaF*Growth**2,
+                'vega': Vega,
+                'theta': -(DecayT + DeltaF*S*Growth*(r-q)),
+                'rho': -Tau*Price + DeltaF*S*Growth*Tau}
@@ -0,0 +1,391 @@
+"""
+Headless batch pricing of a book of trades.
+The book (CSV, or Parquet when pyarrow is installed) is read in chunks of rows, every chunk is split by product
+and each product is priced with its vectorized engine, and the results are appended to the output file,
+so memory stays flat whatever the size of the book.
+
+Columns of the book, by product (q defaults to 0, option_type to 'call'):
+    european:     S, sigma, r, q, T, K, option_type
+    implied_vol:  S, r, q, T, K, V, option_type
+    geo_asian:    S, sigma, r, T, K, n, option_type
+    arith_asian:  S, sigma, r, T, K, n, option_type, m, ctrl_var
+    geo_basket:   s0_1, s0_2, sigma_1, sigma_2, r, T, K, rho, option_type, n
+    arith_basket: s0_1, s0_2, sigma_1, sigma_2, r, T, K, rho, option_type, n, m, ctrl_var
+    american:     S, sigma, r, T, K, N, option_type, method
+Baskets of N assets give s0, sigma, corr and optionally weights instead of s0_1, s0_2, sigma_1, sigma_2 and rho:
+lists of numbers (Parquet lists, or strings separated by ';'), corr holding the N x N matrix row by row
+or a single pairwise correlation; n, the number of observation times of the basket, defaults to 1.
+The output holds the columns of the book followed by value (the price, or the implied volatility),
+conf_low and conf_high (the 95% confidence interval of the Monte Carlo prices).
+A row that cannot be priced (missing or unreadable inputs, too few lattice steps) gets NaN results
+instead of failing its chunk.
+With a PriceCache the products costly to price per contract (the lattice, the Monte Carlo prices and the baskets,
+read row by row) are looked up first and only the contracts missing from it are priced; the vectorized closed
+forms are always priced, as a lookup costs more than the formula.
+"""
+import argparse
+import csv
+from itertools import islice
+import logging
+import sys
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RESULT_COLUMNS = ['value', 'conf_low', 'conf_high']
+DEFAULTS = {'q': 0.0, 'option_type': 'call', 'm': 100000, 'ctrl_var': 'true', 'N': 500, 'method': 'crr'}
+
+
+def _number(value):
+
+    # a number of the book, NaN when the value cannot be read as one
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return np.nan
+
+
+def _column(rows, name, dtype=float):
+
+    values = [row.get(name) if row.get(name) not in (None, '') else DEFAULTS.get(name) for row in rows]
+    if dtype is str:
+        return np.array([str(value).strip().lower() for value in values])
+    return np.array([_number(value) for value in values])
+
+
+def _vector(value):
+
+    # a list of numbers of the book: a list (Parquet, JSON) or a string of numbers separated by ';'
+    if isinstance(value, str):
+        value = value.split(';')
+    return np.array([_number(x) for x in value])
+
+
+def _assets(row):
+
+    # the spot prices, volatilities, correlation matrix and weights of a basket row, None when unreadable
+    try:
+        if row.get('s0') in (None, ''):
+            rho = _number(row.get('rho'))
+            s0 = np.array([_number(row.get('s0_1')), _number(row.get('s0_2'))])
+            sigma = np.array([_number(row.get('sigma_1')), _number(row.get('sigma_2'))])
+            corr = np.array([[1.0, rho], [rho, 1.0]])
+        else:
+            s0, sigma, corr = _vector(row['s0']), _vector(row['sigma']), _vector(row['corr'])
+            if len(corr) == 1:
+                corr = np.full((len(s0), len(s0)), corr[0])
+                np.fill_diagonal(corr, 1.0)
+            corr = corr.reshape(len(s0), len(s0))
+        weights = np.full(len(s0), 1/len(s0)) if row.get('weights') in (None, '') else _vector(row['weights'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if len(sigma) != len(s0) or len(weights) != len(s0):
+        return None
+    return s0, sigma, corr, weights
+
+
+def _observations(rows):
+
+    # the number of observation times of basket rows, 1 when not given
+    return np.where([row.get('n') in (None, '') for row in rows], 1.0, _column(rows, 'n'))
+
+
+def _flag(value):
+
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _per_row(rows, price):
+
+    # closed forms and Monte Carlo pricers taking one contract at a time; a bad row gives NaN, not a failed book
+    values = np.full((len(rows), 3), np.nan)
+    for i, row in enumerate(rows):
+        try:
+            values[i] = price(dict(DEFAULTS, **{name: value for name, value in row.items() if value not in (None, '')}))
+        except (KeyError, TypeError, ValueError, AttributeError, ZeroDivisionError, AssertionError, OverflowError,
+                MemoryError):
+            pass
+    return values
+
+
+def price_european(rows):
+
+    from BSEuroOption import BSEuroOption
+    call, put = BSEuroOption().CallAndPutOption(_column(rows, 'S'), _column(rows, 'sigma'), _column(rows, 'r'),
+                                                _column(rows, 'q'), _column(rows, 'T'), _column(rows, 'K'))
+    value = np.where(_column(rows, 'option_type', str) == 'put', put, call)
+    return np.column_stack([value, value, value])
+
+
+def price_implied_vol(rows, method='bracketed'):
+
+    from ImpliedVolatility import BatchImpliedVolatility
+    sigma = BatchImpliedVolatility(_column(rows, 'S'), _column(rows, 'r'), _column(rows, 'q'), _column(rows, 'T'),
+                                   _column(rows, 'K'), _column(rows, 'V'),
+                                   _column(rows, 'option_type', str)).Volatility(method=method)
+    return np.column_stack([sigma, sigma, sigma])
+
+
+def price_geo_asian(rows):
+
+    from CFGeoAsianOption import GeoAsianOption
+    value = GeoAsianOption.BatchGeoAsian(*(_column(rows, name) for name in ('S', 'sigma', 'r', 'T', 'K', 'n')),
+                                         _column(rows, 'option_type', str))
+    return np.column_stack([value, value, value])
+
+
+def price_geo_basket(rows):
+
+    from CFGeoBasketOption import CFGeoBasketOption
+    # one call of the closed form for all the baskets of the same number of assets
+    assets = [_assets(row) for row in rows]
+    r, T, K, n = _column(rows, 'r'), _column(rows, 'T'), _column(rows, 'K'), _observations(rows)
+    option = _column(rows, 'option_type', str)
+    sizes = np.array([0 if basket is None else len(basket[0]) for basket in assets])
+    value = np.full(len(rows), np.nan)
+    for size in set(sizes[sizes > 0]):
+        idx = np.flatnonzero(sizes == size)
+        s0, sigma, corr, weights = (np.stack(x) for x in zip(*(assets[i] for i in idx)))
+        value[idx] = CFGeoBasketOption.BatchGeoBasket(s0, sigma, corr, weights, r[idx], T[idx], K[idx], n[idx],
+                                                      option[idx])
+    return np.column_stack([value, value, value])
+
+
+def price_arith_asian(rows):
+
+    from MCArithAsianOption import MCArithAsianOption
+    def price(row):
+        option = MCArithAsianOption(s0=float(row['S']), sigma=float(row['sigma']), r=float(row['r']),
+                                    T=float(row['T']), K=float(row['K']), n=int(float(row['n'])),
+                                    m=int(float(row['m'])), option_type=str(row['option_type']).strip().lower(),
+                                    ctrl_var=_flag(row['ctrl_var']))
+        value, conf = option.pricing()
+        return value, conf[0], conf[1]
+    return _per_row(rows, price)
+
+
+def price_arith_basket(rows):
+
+    from MCArithBasketOption import MCArithBasketOption
+    def price(row):
+        s0, sigma, corr, weights = _assets(row)
+        option = MCArithBasketOption(s0=s0, sigma=sigma, corr=corr, weights=weights, n=int(_observations([row])[0]),
+                                     r=float(row['r']), T=float(row['T']), K=float(row['K']),
+                                     option_type=str(row['option_type']).strip().lower(),
+                                     m=int(float(row['m'])), ctrl_var=_flag(row['ctrl_var']))
+        value, conf = option.pricing()
+        return value, conf[0], conf[1]
+    return _per_row(rows, price)
+
+
+def price_american(rows):
+
+    from BiTreeAmericanOption import BiTreeAmericanOption
+    # one lattice sweep for all the contracts sharing the number of steps and the lattice method
+    # N is read as a number ('500.0' is 500 steps), the rows without one stay NaN
+    N, method = _column(rows, 'N'), _column(rows, 'method', str)
+    valid = np.isfinite(N)
+    N = np.where(valid, N, 0).astype(int)
+    value = np.full(len(rows), np.nan)
+    for steps, name in set(zip(N[valid], method[valid])):
+        idx = np.flatnonzero(valid & (N == steps) & (method == name))
+        group = [rows[i] for i in idx]
+        try:
+            value[idx] = BiTreeAmericanOption().BatchBiTreeAmericanOption(
+                _column(group, 'S'), _column(group, 'sigma'), _column(group, 'r'), _column(group, 'T'),
+                _column(group, 'K'), int(steps), _column(group, 'option_type', str), name)
+        except (ValueError, MemoryError):
+            # too few or too many steps for the lattice method, or too many contracts for the memory
+            pass
+    return np.column_stack([value, value, value])
+
+
+# the products a PriceCache answers, only those where a hit is cheaper than pricing the contract again (european and
+# geo_asian price a chunk at a fraction of the cost of its lookups); the Monte Carlo prices are a deterministic
+# function of the row, all rows being simulated with the same seed and sampling settings
+# the columns identifying a contract and how they are normalized in the keys: float for the numbers (rounded by the
+# cache), str for the words, bool for the flags and list for the lists of numbers of the baskets (rounded as well)
+BASKET = [('s0_1', float), ('s0_2', float), ('sigma_1', float), ('sigma_2', float), ('rho', float), ('s0', list),
+          ('sigma', list), ('corr', list), ('weights', list), ('n', float), ('r', float), ('T', float), ('K', float),
+          ('option_type', str)]
+CACHED = {'geo_basket': BASKET,
+          'arith_basket': BASKET + [('m', float), ('ctrl_var', bool)],
+          'arith_asian': [('S', float), ('sigma', float), ('r', float), ('T', float), ('K', float), ('n', float),
+                          ('option_type', str), ('m', float), ('ctrl_var', bool)],
+          'american': [('S', float), ('sigma', float), ('r', float), ('T', float), ('K', float), ('N', float),
+                       ('option_type', str), ('method', str)]}
+
+PRODUCTS = {'european': price_european, 'implied_vol': price_implied_vol, 'geo_asian': price_geo_asian,
+            'arith_asian': price_arith_asian, 'geo_basket': price_geo_basket,
+            'arith_basket': price_arith_basket, 'american': price_american}
+
+
+def _key_column(rows, name, kind, digits):
+
+    # a column of the cache keys of rows, normalized as kind
+    if kind is bool:
+        return np.array([_flag(value) for value in _column(rows, name, str)], dtype=float)
+    if kind is not list:
+        return _column(rows, name, kind)
+    from PriceCache import round_significant
+    column = np.empty(len(rows), dtype=object)
+    for i, row in enumerate(rows):
+        try:
+            if row.get(name) not in (None, ''):
+                column[i] = round_significant(_vector(row[name]), digits).tobytes()
+        except (TypeError, ValueError):
+            # unreadable, the row prices as NaN whatever the rest of its key
+            pass
+    return column
+
+
+def cache_keys(cache, product, rows):
+
+    # the keys of the PriceCache cache for rows of one product of CACHED
+    return cache.keys(product, [_key_column(rows, name, kind, cache.digits) for name, kind in CACHED[product]])
+
+
+def price_chunk(rows, iv_method='bracketed', cache=None):
+    """
+    Args:
+        rows: list of dicts, one per trade, with a 'product' key and the columns of that product
+        iv_method: the implied volatility solver, 'bracketed' or 'newton'
+        cache: a PriceCache.PriceCache answering the contracts of CACHED already priced, None to price every row
+    Returns:
+        (rows x 3) array of value, conf_low and conf_high, NaN for unknown products and failed rows
+    """
+    results = np.full((len(rows), 3), np.nan)
+    products = np.array([str(row.get('product', '')).strip().lower() for row in rows])
+    # the vectorized engines take any option type but 'put' for a call, a misspelled one is left NaN here
+    known = np.isin(_column(rows, 'option_type', str), ['call', 'put'])
+    for product in np.unique(products):
+        if product not in PRODUCTS:
+            logger.warning('unknown product %r in %d rows', product, np.sum(products == product))
+            continue
+        idx = np.flatnonzero((products == product) & known)
+        if len(idx) == 0:
+            continue
+        group = [rows[i] for i in idx]
+        if product == 'implied_vol':
+            results[idx] = price_implied_vol(group, iv_method)
+        elif cache is not None and product in CACHED:
+            # the contracts missing from the cache are priced in one batch
+            results[idx] = cache.get_many(cache_keys(cache, product, group),
+                                          lambda miss: PRODUCTS[product]([group[i] for i in miss]))
+        else:
+            results[idx] = PRODUCTS[product](group)
+    return results
+
+
+def read_chunks(path, chunk_size):
+
+    # the book as lists of row dicts, chunk_size rows at a time
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield rows
+
+
+class ResultWriter:
+    """
+    Appends the priced chunks to a CSV file, or to a Parquet file when the path ends with .parquet.
+
+    Args:
+        path: the output file
+    """
+    def __init__(self, path):
+
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self.file = None
+        self.writer = None
+
+    def write(self, rows, results):
+
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pylist([dict(row, **dict(zip(RESULT_COLUMNS, result)))
+                                          for row, result in zip(rows, results.tolist())])
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table.cast(self.writer.schema))
+            return
+        if self.writer is None:
+            self.columns = list(rows[0])
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns + RESULT_COLUMNS)
+        self.writer.writerows([[row.get(name) for name in self.columns] + result
+                               for row, result in zip(rows, results.tolist())])
+
+    def close(self):
+
+        if self.writer is not None and self.parquet:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def price_book(book, output, chunk_size=10000, iv_method='bracketed', cache=None):
+    """
+    Args:
+        book: path of the book of trades, .csv or .parquet
+        output: path of the results, .csv or .parquet
+        chunk_size: the number of rows read, priced and written at once
+        iv_method: the implied volatility solver, 'bracketed' or 'newton'
+        cache: a PriceCache.PriceCache for the contracts of CACHED repeated in the book, None for no cache
+    Returns:
+        the number of rows priced and the seconds taken
+    """
+    start = time.perf_counter()
+    count = 0
+    writer = ResultWriter(output)
+    try:
+        for rows in read_chunks(book, chunk_size):
+            writer.write(rows, price_chunk(rows, iv_method, cache))
+            count += len(rows)
+            elapsed = time.perf_counter() - start
+            logger.info('%d rows in %.2fs (%.0f rows/s)', count, elapsed, count / elapsed)
+    finally:
+        writer.close()
+    return count, time.perf_counter() - start
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Price a book of trades without the GUI.')
+    parser.add_argument('book', help='the book of trades, .csv or .parquet (needs pyarrow)')
+    parser.add_argument('output', help='the results, .csv or .parquet (needs pyarrow)')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows read, priced and written at once')
+    parser.add_argument('--iv-method', default='bracketed', choices=['bracketed', 'newton'],
+                        help='the implied volatility solver')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='prices kept for the contracts repeated in the book, 0 for no cache')
+    parser.add_argument('--verbose', action='store_true', help='log the progress after every chunk')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    cache = None
+    if args.cache_size > 0:
+        from PriceCache import PriceCache
+        cache = PriceCache(maxsize=args.cache_size)
+    count, elapsed = price_book(args.book, args.output, args.chunk_size, args.iv_method, cache)
+    if cache is not None:
+        logger.info('cache: %s', cache.stats())
+    print('{} rows in {:.2f}s ({:.0f} rows/s)'.format(count, elapsed, count / elapsed if elapsed > 0 else 0.0),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
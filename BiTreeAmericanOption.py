@@ -5,12 +5,24 @@
 
 
 import numpy as np
+from BSEuroOption import BSEuroOption, OptionSign
+
+
+#the most steps of a lattice: the backward induction costs N**2/2 node updates per contract,
+#so a larger N (a typo like 1e12) would exhaust the memory or run for hours
+MaxSteps = 100000
 
 
 # In[10]:
+def _PeizerPratt(z, n):
+
+    #Peizer-Pratt method 2 inversion of the binomial distribution used by the Leisen-Reimer tree
+    return 0.5 + np.sign(z) * 0.5 * np.sqrt(1 - np.exp(-(z / (n + 1/3 + 0.1/(n + 1)))**2 * (n + 1/6)))
+
+
 class BiTreeAmericanOption():
 
-    def BiTreeAmericanOption(self, S0, sigma, r, T, K, N, option = 'call'):
+    def BiTreeAmericanOption(self, S0, sigma, r, T, K, N, option = 'call', method = 'crr', cancel = None):
     
         #S0: the spot price of asset S(0)
         #K: strike price
@@ -19,39 +31,158 @@ class BiTreeAmericanOption():
         #r: risk-free interest rate
         #sigma: volatility of underlying asset
         #option: option type (call or put)
+        #method: 'crr' for the Cox-Ross-Rubinstein tree, 'bbs' for the tree with a Black-Scholes last step,
+        #        'bbsr' for 'bbs' with two-point Richardson extrapolation, 'lr' for the Leisen-Reimer tree
+        #cancel: optional threading.Event, checked every level; once set the lattice raises MCEngine.SimulationCancelled
+        sign = float(OptionSign(option))
+        return self._Lattice(S0, sigma, r, T, K, sign, N, method, cancel = cancel)
+
+    def BatchBiTreeAmericanOption(self, S0, sigma, r, T, K, N, option = 'call', method = 'crr'):
+    
+        #price many contracts sharing the same N in one sweep over a 2-D lattice
+        #S0, sigma, r, T, K and option are arrays (or scalars) broadcast against each other
+        S0, sigma, r, T, K, option = np.broadcast_arrays(S0, sigma, r, T, K, option)
+        shape = S0.shape
+        S0, sigma, r, T, K = (np.asarray(x, dtype=float).ravel() for x in (S0, sigma, r, T, K))
+        #sign of the payoff, +1 for the calls and -1 for the puts
+        sign = OptionSign(np.ravel(option))
+        return self._Lattice(S0, sigma, r, T, K, sign, N, method).reshape(shape)
+
+    def BiTreeAmericanGreeks(self, S0, sigma, r, T, K, N, option = 'call', method = 'crr'):
+    
+        #price, delta, gamma and theta read off the first levels of the lattice, for one or many contracts
+        S0, sigma, r, T, K, option = np.broadcast_arrays(S0, sigma, r, T, K, option)
+        shape = S0.shape
+        S0, sigma, r, T, K = (np.asarray(x, dtype=float).ravel() for x in (S0, sigma, r, T, K))
+        sign = OptionSign(np.ravel(option))
+        values = self._Lattice(S0, sigma, r, T, K, sign, N, method, greeks = True)
+        return {name: value.reshape(shape)[()] for name, value in zip(('price', 'delta', 'gamma', 'theta'), values)}
+
+    def _Lattice(self, S0, sigma, r, T, K, sign, N, method = 'crr', greeks = False, cancel = None):
+    
+        #backward induction for scalars or 1-D arrays of contracts, returns the option values at time 0
+        #and, with greeks, the delta, gamma and theta from the nodes of levels 1 and 2
+        #one step is the least for a price and three for the greeks, which read the nodes of level 2;
+        #'bbsr' needs twice as many, its coarse tree having N // 2 steps
+        least = (3 if greeks else 1) * (2 if method == 'bbsr' else 1)
+        if N < least:
+            raise ValueError('the {} lattice needs at least {} steps{}, got N = {}'.format(
+                method, least, ' for the greeks' if greeks else '', N))
+        if N > MaxSteps:
+            raise ValueError('the lattice takes at most {} steps, got N = {}'.format(MaxSteps, N))
+        if method == 'bbsr':
+            #two-point Richardson extrapolation removes the leading 1/N error term of the smoothed tree
+            fine = self._Lattice(S0, sigma, r, T, K, sign, N, 'bbs', greeks, cancel)
+            coarse = self._Lattice(S0, sigma, r, T, K, sign, N // 2, 'bbs', greeks, cancel)
+            if greeks:
+                return tuple(2 * a - b for a, b in zip(fine, coarse))
+            return 2 * fine - coarse
+        if method == 'lr' and N % 2 == 0:
+            #the Leisen-Reimer tree is centred on the strike for an odd number of steps
+            N += 1
     
         #deltt: delta_t
-        deltat = float(T)/N
-        u = np.exp(sigma * np.sqrt(deltat))
-        d = np.exp(-sigma * np.sqrt(deltat))
-        #p: probability
-        p = (np.exp(r * deltat) - d) / (u - d)
-        #DF: discount factor
+        deltat = T/N
+        growth = np.exp(r * deltat)
+        if method == 'lr':
+            d1 = (np.log(S0/K) + (r + 0.5 * sigma**2) * T) / (sigma * np.sqrt(T))
+            d2 = d1 - sigma * np.sqrt(T)
+            p = _PeizerPratt(d2, N)
+            u = growth * _PeizerPratt(d1, N) / p
+            d = (growth - p * u) / (1 - p)
+        else:
+            u = np.exp(sigma * np.sqrt(deltat))
+            d = np.exp(-sigma * np.sqrt(deltat))
+            #p: probability
+            p = (growth - d) / (u - d)
+        #DF: discount factor, folded into the probabilities
         DF = np.exp(-r * deltat)
+        pu = DF * p
+        pd = DF * (1 - p)
+        #going one level back multiplies the stock price of a node by 1/d
+        back = 1 / d
     
-        #to work with vector we need to init the arrays using numpy
-        fs =  np.asarray([0.0 for i in range(N + 1)])    
-        #we need the stock tree for calculations of expiration values
-        fs2 = np.asarray([(S0 * u**j * d**(N - j)) for j in range(N + 1)])
-        #we vectorize the strikes as well so the expiration check will be faster
-        fs3 =np.asarray( [float(K) for i in range(N + 1)])
+        #the lattice is stored (nodes x contracts) and allocated once, so the live region
+        #of every level is one contiguous block updated in place
+        fs = np.empty((N + 1,) + np.shape(S0))
+        #scratch buffer for the up-branch values and the exercise values
+        tmp = np.empty(fs.shape)
+        #the stock tree S0*u**j*d**(N-j) and the strikes carry the sign of the payoff,
+        #so exercising is a single subtraction
+        j = np.arange(N + 1).reshape((-1,) + (1,) * np.ndim(S0))
+        fs2 = sign * S0 * np.exp(j * np.log(u) + (N - j) * np.log(d))
+        K = sign * K
     
         # Compute the leaves, f_{N, j}
-        if option == 'call':
-            fs[:] = np.maximum(fs2-fs3, 0.0) 
-        if option == 'put':
-            fs[:] = np.maximum(fs3-fs2, 0.0) 
+        np.subtract(fs2, K, out=fs)
+        np.maximum(fs, 0.0, out=fs)
+        #option values and stock prices of the nodes of levels 1 and 2, for the greeks
+        levels = {}
     
-        #calculate backward the option prices
+        #calculate backward the option prices, level i has i+1 live nodes
         for i in range(N-1, -1, -1):
         
-            fs[:-1]= DF * (p * fs[1:] + (1-p) * fs[:-1])
-            fs2[:]=fs2[:]*u
+            if cancel is not None and cancel.is_set():
+                from MCEngine import SimulationCancelled
+                raise SimulationCancelled('the lattice was cancelled')
+            
+            live = fs[:i + 1]
+            up = tmp[:i + 1]
+            stock = fs2[:i + 1]
+            np.multiply(stock, back, out=stock)
+            
+            if method == 'bbs' and i == N - 1:
+                #the European value over the last step replaces the continuation value
+                call, put = BSEuroOption().CallAndPutOption(sign * stock, sigma, r, 0, deltat, sign * K)
+                live[:] = np.where(sign > 0, call, put)
+            else:
+                np.multiply(fs[1:i + 2], pu, out=up)
+                np.multiply(live, pd, out=live)
+                np.add(live, up, out=live)
+        
+            #early exercise
+            np.subtract(stock, K, out=up)
+            np.maximum(live, up, out=live)
+            
+            if greeks and i <= 2:
+                levels[i] = (live.copy(), sign * stock)
         
-            if option == 'call':
-                    fs[:]=np.maximum(fs[:],fs2[:]-fs3[:])
-            if option == 'put':
-                    fs[:]=np.maximum(fs[:],-fs2[:]+fs3[:])
-                
-        # print fs
+        if greeks:
+            (f1, S1), (f2, S2) = levels[1], levels[2]
+            delta = (f1[1] - f1[0]) / (S1[1] - S1[0])
+            gamma = ((f2[2] - f2[1]) / (S2[2] - S2[1]) - (f2[1] - f2[0]) / (S2[1] - S2[0])) / ((S2[2] - S2[0]) / 2)
+            #the middle node of level 2 sits at S0 only when u*d = 1, otherwise move it back to S0 along delta/gamma
+            shift = S0 - S2[1]
+            theta = (f2[1] + delta * shift + 0.5 * gamma * shift**2 - fs[0]) / (2 * deltat)
+            return fs[0], delta, gamma, theta
         return fs[0]
+
+if __name__ == '__main__':
+    # benchmark of the lattice for growing numbers of steps
+    import timeit
+    option = BiTreeAmericanOption()
+    for N in (1000, 2000, 5000, 10000, 20000):
+        cost = min(timeit.repeat(lambda: option.BiTreeAmericanOption(S0=50, sigma=0.4, r=0.1, T=2, K=52, N=N, option='put'),
+                                 number=1, repeat=3))
+        print('N = {:>6}: put = {:.8f}, {:8.2f} ms'.format(N, option.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, N, 'put'), cost * 1e3))
+
+    # one sweep for a book of contracts against one lattice per contract
+    rng = np.random.default_rng(0)
+    book = dict(S0=rng.uniform(80, 120, 2000), sigma=rng.uniform(0.1, 0.5, 2000), r=0.03,
+                T=rng.uniform(0.1, 2, 2000), K=100, N=200, option=np.where(rng.random(2000) < 0.5, 'call', 'put'))
+    cost = min(timeit.repeat(lambda: option.BatchBiTreeAmericanOption(**book), number=1, repeat=3))
+    print('batch of 2000 contracts, N = 200: {:8.2f} ms'.format(cost * 1e3))
+    single = dict(book, option=book['option'][:200], S0=book['S0'][:200], sigma=book['sigma'][:200], T=book['T'][:200])
+    cost = min(timeit.repeat(lambda: [option.BiTreeAmericanOption(*args, N=200, option=o) for *args, o in
+                                      zip(single['S0'], single['sigma'], [0.03]*200, single['T'], [100]*200, single['option'])],
+                             number=1, repeat=3))
+    print('2000 contracts one at a time, N = 200: {:8.2f} ms'.format(cost * 10 * 1e3))
+
+    # accuracy against time of the lattice methods, the reference is a very large extrapolated tree
+    reference = option.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, 20000, 'put', 'bbsr')
+    for method in ('crr', 'bbs', 'bbsr', 'lr'):
+        for N in (50, 100, 200, 400, 800):
+            cost = min(timeit.repeat(lambda: option.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, N, 'put', method),
+                                     number=5, repeat=3)) / 5
+            error = abs(option.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, N, 'put', method) - reference)
+            print('{:<5} N = {:>4}: error = {:.2e}, {:6.2f} ms'.format(method, N, error, cost * 1e3))
@@ -4,7 +4,9 @@ Implement closed-form formulas for geometric Asian call/put options.
 """
 import math
 from math import e
-from scipy.stats import norm
+import numpy as np
+from BSEuroOption import BSEuroOption
+from SpecialFunctions import ncdf_scalar
 
 class GeoAsianOption():
     
@@ -31,11 +33,11 @@ class GeoAsianOption():
         sigma_hat = sigma*math.sqrt(((n + 1)*(2*n + 1))/(6*n**2))
         mu = (r - (1/2)*sigma**2)*((n+1)/(2*n))+(1/2)*sigma_hat**2
     
-        d1 = ((math.log(S/K) + (mu + (1/2)*sigma_hat**2))*T)/(sigma_hat*math.sqrt(T))
+        d1 = (math.log(S/K) + (mu + (1/2)*sigma_hat**2)*T)/(sigma_hat*math.sqrt(T))
         d2 = d1 - sigma_hat*math.sqrt(T)
     
-        N_d1_P = norm.cdf(d1)
-        N_d2_P = norm.cdf(d2)
+        N_d1_P = ncdf_scalar(d1)
+        N_d2_P = ncdf_scalar(d2)
 
         # the closed-form formulas for geometric Asian call option 
         Call = e**(-(r*T))*(S*e**(mu*T)*N_d1_P - K*N_d2_P)
@@ -50,14 +52,46 @@ class GeoAsianOption():
         sigma_hat = sigma*math.sqrt(((n + 1)*(2*n + 1))/(6*n**2))
         mu = (r - (1/2)*sigma**2)*((n+1)/(2*n))+(1/2)*sigma_hat**2
         
-        d1 = ((math.log(S/K) + (mu + (1/2)*sigma_hat**2))*T)/(sigma_hat*math.sqrt(T))
+        d1 = (math.log(S/K) + (mu + (1/2)*sigma_hat**2)*T)/(sigma_hat*math.sqrt(T))
         d2 = d1 - sigma_hat*math.sqrt(T)
         
-        N_d1_N = norm.cdf(-d1)
-        N_d2_N = norm.cdf(-d2)
+        N_d1_N = ncdf_scalar(-d1)
+        N_d2_N = ncdf_scalar(-d2)
         
         # the closed-form formulas for geometric Asian put option 
         Put = e**(-(r*T))*(K*N_d2_N - S*e**(mu*T)*N_d1_N)
         
         return Put
-    
\ No newline at end of file
+    
+    # price arrays of contracts at once, with Black's formula on the forward S*e^(mu*T);
+    # all inputs are arrays (or scalars) broadcast against each other
+    @staticmethod
+    def BatchGeoAsian(S, sigma, r, T, K, n, option = 'call'):
+        
+        S, sigma, r, T, K, n = (np.asarray(x, dtype = float) for x in (S, sigma, r, T, K, n))
+        
+        sigma_hat = sigma*np.sqrt(((n + 1)*(2*n + 1))/(6*n**2))
+        mu = (r - (1/2)*sigma**2)*((n + 1)/(2*n)) + (1/2)*sigma_hat**2
+        
+        return BSEuroOption().BlackGreeks(S*np.exp(mu*T), sigma_hat, r, T, K, option)[0]
+    
+    # price, delta, gamma, vega, theta and rho, with the closed form written on the forward S*e^(mu*T)
+    def GreeksGeoAsian(self, option = 'call'):
+        
+        S, sigma, r, T, K, n = self.S, self.sigma, self.r, self.T, self.K, self.n
+        
+        c = math.sqrt(((n + 1)*(2*n + 1))/(6*n**2))
+        a = (n + 1)/(2*n)
+        sigma_hat = sigma*c
+        mu = (r - (1/2)*sigma**2)*a + (1/2)*sigma_hat**2
+        F = S*e**(mu*T)
+        
+        Price, DeltaF, GammaF, Vega, DecayT = BSEuroOption().BlackGreeks(F, sigma_hat, r, T, K, option)
+        
+        # mu depends on sigma and r as well as the volatility sigma_hat of the geometric average
+        return {'price': float(Price),
+                'delta': float(DeltaF*F/S),
+                'gamma': float(GammaF*(F/S)**2),
+                'vega': float(Vega*c + DeltaF*F*T*(sigma*c**2 - sigma*a)),
+                'theta': float(-(DecayT + DeltaF*F*mu)),
+                'rho': float(-T*Price + DeltaF*F*T*a)}
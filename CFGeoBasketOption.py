@@ -6,12 +6,15 @@ Implement closed-form formulas for geometric basket call/put options.
 import math
 from math import e
 from numpy.random import standard_normal as StdNormal
-from scipy.stats import norm
+import numpy as np
+from BSEuroOption import BSEuroOption
+from SpecialFunctions import ncdf_scalar
 
 class CFGeoBasketOption:
 
     def __init__(self, s0_1 = None, s0_2 = None, sigma_1 = None, sigma_2 = None, 
-                 r = 0, T = 0, K = None, rho = None, option_type = None):
+                 r = 0, T = 0, K = None, rho = None, option_type = None,
+                 s0 = None, sigma = None, corr = None, weights = None, n = 1):
 
         #assert option_type == 'call' or option_type == 'put'
         # the Spot Price of Asset S1(0)
@@ -31,21 +34,55 @@ class CFGeoBasketOption:
         # the correlation
         self.rho = rho
         self.option_type = option_type
+        # N-asset basket: the Spot Prices, the Volatilities and the correlation matrix of the assets,
+        # used instead of s0_1, s0_2, sigma_1, sigma_2 and rho when given
+        self.s0 = s0
+        self.sigma = sigma
+        self.corr = corr
+        # the weights of the assets in the basket, equal weights 1/N by default
+        self.weights = weights
+        # the number of equally spaced observation times, the geometric average running over the times and the assets
+        self.n = n
 
-    def CallGeoBasket(self, t = 0):
+    # the Spot Prices, Volatilities, correlation matrix and weights of the assets as arrays
+    def Assets(self):
+        
+        if self.s0 is None:
+            s0 = np.array([self.s0_1, self.s0_2], dtype = float)
+            sigma = np.array([self.sigma_1, self.sigma_2], dtype = float)
+            corr = np.array([[1, self.rho], [self.rho, 1]], dtype = float)
+        else:
+            s0 = np.asarray(self.s0, dtype = float)
+            sigma = np.asarray(self.sigma, dtype = float)
+            corr = np.asarray(self.corr, dtype = float)
+        n = len(s0)
+        weights = np.full(n, 1/n) if self.weights is None else np.asarray(self.weights, dtype = float)
         
-        s0_1, s0_2, sigma_1, sigma_2, r, T, K, rho = self.s0_1, self.s0_2, self.sigma_1, self.sigma_2, self.r, self.T, self.K, self.rho
+        return s0, sigma, corr, weights
+    
+    # the volatility sigma_B and the drift mu of the geometric basket prod(S_i^w_i), averaged geometrically
+    # over the n observation times, and its spot value Bg
+    def GeoBasketParameters(self):
         
-        C11, C12, C22 = 1, rho, 1 
-        sigma_B = math.sqrt((sigma_1**2)*C11 + 2*sigma_1*sigma_2*C12 + sigma_2**2*C22)/2
-        mu = r - (1/2)*((sigma_1**2 + sigma_2**2)/2) + (1/2)*sigma_B**2
+        s0, sigma, corr, weights = self.Assets()
+        n = self.n
+        
+        sigma_B = math.sqrt(weights*sigma @ corr @ (weights*sigma) * (n + 1)*(2*n + 1)/(6*n**2))
+        mu = (self.r*np.sum(weights) - (1/2)*np.sum(weights*sigma**2))*(n + 1)/(2*n) + (1/2)*sigma_B**2
+        Bg = math.exp(np.sum(weights*np.log(s0)))
+        
+        return sigma_B, float(mu), Bg
+
+    def CallGeoBasket(self, t = 0):
+        
+        r, T, K = self.r, self.T, self.K
+        sigma_B, mu, Bg = self.GeoBasketParameters()
         
-        Bg = math.sqrt(s0_1*s0_2)
         d1 = (math.log(Bg/K) + (mu + (1/2)*sigma_B**2)*T)/(sigma_B*math.sqrt(T))
         d2 = d1 - sigma_B*math.sqrt(T)
         
-        N_d1_P = norm.cdf(d1)
-        N_d2_P = norm.cdf(d2)
+        N_d1_P = ncdf_scalar(d1)
+        N_d2_P = ncdf_scalar(d2)
         
         # closed-form formula for geometric basket call option
         Call = e**(-(r*T))*(Bg*e**(mu*T)*N_d1_P - K*N_d2_P)
@@ -54,20 +91,57 @@ class CFGeoBasketOption:
     
     def PutGeoBasket(self, t = 0):
         
-        s0_1, s0_2, sigma_1, sigma_2, r, T, K, rho = self.s0_1, self.s0_2, self.sigma_1, self.sigma_2, self.r, self.T, self.K, self.rho
-        
-        C11, C12, C22 = 1, rho, 1 
-        sigma_B = math.sqrt((sigma_1**2)*C11 + 2*sigma_1*sigma_2*C12 + sigma_2**2*C22)/2
-        mu = r - (1/2)*((sigma_1**2 + sigma_2**2)/2) + (1/2)*sigma_B**2
+        r, T, K = self.r, self.T, self.K
+        sigma_B, mu, Bg = self.GeoBasketParameters()
         
-        Bg = math.sqrt(s0_1*s0_2)
         d1 = (math.log(Bg/K) + (mu + (1/2)*sigma_B**2)*T)/(sigma_B*math.sqrt(T))
         d2 = d1 - sigma_B*math.sqrt(T)
         
-        N_d1_N = norm.cdf(-d1)
-        N_d2_N = norm.cdf(-d2)
+        N_d1_N = ncdf_scalar(-d1)
+        N_d2_N = ncdf_scalar(-d2)
         
         # closed-form formula for geometric basket put option
         Put = e**(-(r*T))*(K*N_d2_N - Bg*e**(mu*T)*N_d1_N)
         
         return Put
+    
+    # price arrays of baskets at once, with Black's formula on the forward Bg*e^(mu*T):
+    # s0, sigma and weights are (contracts x N), corr is (contracts x N x N) or one N x N matrix,
+    # weights None for equal weights; r, T, K, n and option are arrays (or scalars) of the contracts
+    @staticmethod
+    def BatchGeoBasket(s0, sigma, corr, weights, r, T, K, n = 1, option = 'call'):
+        
+        s0, sigma, corr = (np.asarray(x, dtype = float) for x in (s0, sigma, corr))
+        N = s0.shape[-1]
+        weights = np.full(s0.shape, 1/N) if weights is None else np.asarray(weights, dtype = float)
+        r, T, K, n = (np.asarray(x, dtype = float) for x in (r, T, K, n))
+        
+        # the same parameters as GeoBasketParameters, for every contract
+        ws = weights*sigma
+        sigma_B = np.sqrt(np.einsum('...i,...ij,...j->...', ws, corr, ws) * (n + 1)*(2*n + 1)/(6*n**2))
+        mu = (r*np.sum(weights, axis = -1) - (1/2)*np.sum(weights*sigma**2, axis = -1))*(n + 1)/(2*n) + (1/2)*sigma_B**2
+        Bg = np.exp(np.sum(weights*np.log(s0), axis = -1))
+        
+        return BSEuroOption().BlackGreeks(Bg*np.exp(mu*T), sigma_B, r, T, K, option)[0]
+    
+    # price, delta/gamma/vega per asset, theta and rho, with the closed form written on the forward Bg*e^(mu*T)
+    def GreeksGeoBasket(self, option = 'call'):
+        
+        r, T, K = self.r, self.T, self.K
+        S, sigma, corr, weights = self.Assets()
+        sigma_B, mu, Bg = self.GeoBasketParameters()
+        F = Bg*e**(mu*T)
+        
+        Price, DeltaF, GammaF, Vega, DecayT = BSEuroOption().BlackGreeks(F, sigma_B, r, T, K, option)
+        
+        # dF/dS_i = w_i*F/S_i, and sigma_B and mu depend on all the volatilities
+        n = self.n
+        dSigmaB = weights*(corr @ (weights*sigma))/sigma_B * (n + 1)*(2*n + 1)/(6*n**2)
+        dMu = -weights*sigma*(n + 1)/(2*n) + sigma_B*dSigmaB
+        
+        return {'price': float(Price),
+                'delta': DeltaF*weights*F/S,
+                'gamma': GammaF*(weights*F/S)**2 + DeltaF*weights*(weights - 1)*F/S**2,
+                'vega': Vega*dSigmaB + DeltaF*F*T*dMu,
+                'theta': float(-(DecayT + DeltaF*F*mu)),
+                'rho': float(-T*Price + DeltaF*F*T*np.sum(weights)*(n + 1)/(2*n))}
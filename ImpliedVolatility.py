@@ -4,9 +4,10 @@ Implement Volatility Calculator for European Call/Put Options with Newton Raphso
 """
 
 import math
-from BSEuroOption import BSEuroOption
+from BSEuroOption import BSEuroOption, OptionSign
 from math import e
-from scipy.stats import norm
+import numpy as np
+from SpecialFunctions import ncdf, npdf, npdf_scalar
 
 class ImpliedVolatility(BSEuroOption):
     
@@ -37,14 +38,18 @@ class ImpliedVolatility(BSEuroOption):
     def CallAndPutDerivative(self, S, K, q, T, r, sigma, t = 0):
         
         d1 = (math.log(S/K) + (r-q)*(T-t))/(sigma*math.sqrt(T-t)) + (1/2)*sigma*math.sqrt(T-t)
-        diff_N_d1 = norm.pdf(d1)
+        diff_N_d1 = npdf_scalar(d1)
         Dev = S*e**(-q*(T-t))*math.sqrt(T-t)*diff_N_d1
         return Dev 
     
-    def CallVolatility(self, m_max = 100, tolerance = 1e-8):
+    def CallVolatility(self, m_max = 100, tolerance = 1e-8, method = 'newton'):
         
         # m_max: the max iteration steps for Newton Raphson Method
         # tolerance: tolerance for the Newton Raphson Method
+        # method: 'newton' for the plain Newton Raphson Method, 'bracketed' for the safeguarded solver
+        if method == 'bracketed':
+            return float(BatchImpliedVolatility(self.S, self.r, self.q, self.T, self.K, self.V, 'call', self.t).Volatility(m_max, tolerance, method))
+        
         # the initial iteration step for Newton Raphson Method 
         m = 1
         # create initial sigma value as the input for Newton Raphson Method
@@ -64,10 +69,14 @@ class ImpliedVolatility(BSEuroOption):
             
         return SigmaNewCall
     
-    def PutVolatility(self, n_max = 100, tolerance = 1e-8):
+    def PutVolatility(self, n_max = 100, tolerance = 1e-8, method = 'newton'):
         
         # n_max: the max iteration steps for Newton Raphson Method
         # tolerance: tolerance for the Newton Raphson Method
+        # method: 'newton' for the plain Newton Raphson Method, 'bracketed' for the safeguarded solver
+        if method == 'bracketed':
+            return float(BatchImpliedVolatility(self.S, self.r, self.q, self.T, self.K, self.V, 'put', self.t).Volatility(n_max, tolerance, method))
+        
         # the initial iteration step for Newton Raphson Method
         n = 1
         # create initial sigma value as the input for Newton Raphson Method
@@ -86,4 +95,168 @@ class ImpliedVolatility(BSEuroOption):
             n += 1
             
         return SigmaNewCall
-    
\ No newline at end of file
+
+
+class BatchImpliedVolatility:
+    
+    # solve the implied volatilities of a whole option chain at once; all inputs broadcast against each other
+    def __init__(self, S, r, q, T, K, V, option_type, t = 0):
+        
+        S, r, q, T, K, V, t, option_type = np.broadcast_arrays(S, r, q, T, K, V, t, option_type)
+        # the Spot Price of Asset S(0)
+        self.S = S.astype(float).ravel()
+        # the Risk-free Interest Rate
+        self.r = r.astype(float).ravel()
+        # the Repo Rate q
+        self.q = q.astype(float).ravel()
+        # Time to Maturity (in year)
+        self.T = T.astype(float).ravel()
+        # Current Time (in year)
+        self.t = t.astype(float).ravel()
+        # Strike
+        self.K = K.astype(float).ravel()
+        # The Option Premium
+        self.V = V.astype(float).ravel()
+        # True for the call options, False for the put options
+        self.IsCall = (OptionSign(option_type) > 0).ravel()
+        self.shape = S.shape
+    
+    # set a initial sigma value for Newton Raphson Method
+    def SigmaInit(self):
+        
+        S, K, q, T, t, r = self.S, self.K, self.q, self.T, self.t, self.r
+        return np.sqrt(2*np.abs((np.log(S/K)+(r-q)*(T-t))/(T-t)))
+    
+    # the option premium and its derivative w.r.t. sigma, sharing d1/d2, for the contracts in idx
+    def PriceAndVega(self, idx, sigma, IsCall = None):
+        
+        S, r, q, K = self.S[idx], self.r[idx], self.q[idx], self.K[idx]
+        IsCall = self.IsCall[idx] if IsCall is None else IsCall[idx]
+        Tau = self.T[idx] - self.t[idx]
+        
+        SigmaSqrtTau = sigma*np.sqrt(Tau)
+        d1 = (np.log(S/K) + (r-q)*Tau)/SigmaSqrtTau + (1/2)*SigmaSqrtTau
+        d2 = d1 - SigmaSqrtTau
+        DiscountedS = S*np.exp(-q*Tau)
+        DiscountedK = K*np.exp(-r*Tau)
+        
+        # N(-d) for the puts, so that a single cdf call prices both types
+        Sign = np.where(IsCall, 1.0, -1.0)
+        Price = Sign*(DiscountedS*ncdf(Sign*d1) - DiscountedK*ncdf(Sign*d2))
+        Vega = DiscountedS*np.sqrt(Tau)*npdf(d1)
+        
+        return Price, Vega
+    
+    # the no-arbitrage bounds of the option premium
+    def PriceBounds(self):
+        
+        Tau = self.T - self.t
+        DiscountedS = self.S*np.exp(-self.q*Tau)
+        DiscountedK = self.K*np.exp(-self.r*Tau)
+        Lower = np.where(self.IsCall, np.maximum(DiscountedS - DiscountedK, 0), np.maximum(DiscountedK - DiscountedS, 0))
+        Upper = np.where(self.IsCall, DiscountedS, DiscountedK)
+        return Lower, Upper
+    
+    # rational initial guess of Corrado and Miller, much closer to the root than SigmaInit away from the money
+    def RationalInit(self):
+        
+        Tau = self.T - self.t
+        DiscountedS = self.S*np.exp(-self.q*Tau)
+        DiscountedK = self.K*np.exp(-self.r*Tau)
+        # convert the puts to calls with the put-call parity
+        C = np.where(self.IsCall, self.V, self.V + DiscountedS - DiscountedK)
+        Half = C - (DiscountedS - DiscountedK)/2
+        Root = np.sqrt(np.maximum(Half**2 - (DiscountedS - DiscountedK)**2/math.pi, 0))
+        return math.sqrt(2*math.pi)/(DiscountedS + DiscountedK)*(Half + Root)/np.sqrt(Tau)
+    
+    def Volatility(self, m_max = 100, tolerance = 1e-8, method = 'newton'):
+        
+        # method: 'newton' for the plain Newton Raphson Method, 'bracketed' for the safeguarded solver
+        if method == 'bracketed':
+            sigma = self.BracketedVolatility(m_max, tolerance)
+        else:
+            sigma = self.NewtonVolatility(m_max, tolerance)
+        return sigma.reshape(self.shape)
+    
+    def NewtonVolatility(self, m_max = 100, tolerance = 1e-8):
+        
+        # m_max: the max iteration steps for Newton Raphson Method
+        # tolerance: tolerance for the Newton Raphson Method
+        with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+            
+            # quotes outside the no-arbitrage bounds have no implied volatility, as in BracketedVolatility
+            Lower, Upper = self.PriceBounds()
+            active = (self.V > Lower) & (self.V < Upper) & (self.T > self.t)
+            sigma = np.where(active, self.SigmaInit(), np.nan)
+            
+            # only the contracts that have not converged yet are evaluated
+            for m in range(m_max):
+                
+                idx = np.flatnonzero(active)
+                if idx.size == 0:
+                    break
+                
+                Price, Vega = self.PriceAndVega(idx, sigma[idx])
+                SigmaDiff = (Price - self.V[idx])/Vega
+                sigma[idx] = sigma[idx] - SigmaDiff
+                # NaN/inf steps can not recover, so they stop iterating as well
+                active[idx[~(np.abs(SigmaDiff) > tolerance)]] = False
+        
+        return sigma
+    
+    def BracketedVolatility(self, m_max = 100, tolerance = 1e-8):
+        
+        # Newton Raphson Method kept inside a bracket [SigmaLow, SigmaHigh] around the root, falling back to
+        # bisection whenever the Newton step leaves it, so every quote within the no-arbitrage bounds converges
+        with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+            
+            Lower, Upper = self.PriceBounds()
+            sigma = np.full(self.V.shape, np.nan)
+            # quotes outside the no-arbitrage bounds have no implied volatility
+            active = (self.V > Lower) & (self.V < Upper) & (self.T > self.t)
+            
+            # solve on the out-of-the-money side (put-call parity), where the premium carries no intrinsic value
+            Tau = self.T - self.t
+            Forward = self.S*np.exp(-self.q*Tau) - self.K*np.exp(-self.r*Tau)
+            IsCall = Forward <= 0
+            V = np.where(IsCall == self.IsCall, self.V, self.V - np.where(self.IsCall, Forward, -Forward))
+            Cheap = V < 0.5*np.where(IsCall, self.S*np.exp(-self.q*Tau), self.K*np.exp(-self.r*Tau))
+            
+            idx = np.flatnonzero(active)
+            SigmaLow = np.zeros(self.V.shape)
+            SigmaHigh = np.full(self.V.shape, np.nan)
+            sigma[idx] = np.nan_to_num(self.RationalInit()[idx])
+            
+            # expand the upper end of the bracket until it prices above the quote
+            High = np.maximum(2*sigma[idx], 1.0)
+            for m in range(64):
+                Price, _ = self.PriceAndVega(idx, High, IsCall)
+                Below = Price < V[idx]
+                if not Below.any():
+                    break
+                High[Below] *= 2
+            SigmaHigh[idx] = High
+            sigma[idx] = np.clip(sigma[idx], 1e-3*High, 0.5*High)
+            
+            for m in range(m_max):
+                
+                idx = np.flatnonzero(active)
+                if idx.size == 0:
+                    break
+                
+                Price, Vega = self.PriceAndVega(idx, sigma[idx], IsCall)
+                Diff = Price - V[idx]
+                # the premium is increasing in sigma, so the sign of Diff tells which end of the bracket moves
+                SigmaHigh[idx] = np.where(Diff > 0, sigma[idx], SigmaHigh[idx])
+                SigmaLow[idx] = np.where(Diff < 0, sigma[idx], SigmaLow[idx])
+                
+                # Newton step on log(premium) for cheap quotes, where the premium itself is far too convex in sigma
+                SigmaNew = sigma[idx] - np.where(Cheap[idx], np.log(Price/V[idx])*Price, Diff)/Vega
+                Outside = ~((SigmaNew > SigmaLow[idx]) & (SigmaNew < SigmaHigh[idx]))
+                SigmaNew[Outside] = 0.5*(SigmaLow[idx] + SigmaHigh[idx])[Outside]
+                
+                SigmaDiff = np.abs(SigmaNew - sigma[idx])
+                sigma[idx] = SigmaNew
+                active[idx[(SigmaDiff <= tolerance) | (Diff == 0)]] = False
+        
+        return sigma
@@ -0,0 +1,88 @@
+"""
+Import-time regression check of the entry points.
+Every module is imported in a fresh interpreter under python -X importtime; the check reports its cumulative
+import time and fails when it pulls in a heavy dependency it should defer until first use, or exceeds a budget.
+
+    python ImportTime.py [--repeat 5] [--budget 300]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# module -> the packages it must not import at startup
+CHECKS = {'Application': ['numpy', 'scipy'],
+          'BatchPricer': ['scipy'],
+          'PricingServer': ['scipy'],
+          'SpecialFunctions': ['scipy'],
+          'BSEuroOption': ['scipy'],
+          'ImpliedVolatility': ['scipy'],
+          'CFGeoAsianOption': ['scipy'],
+          'CFGeoBasketOption': ['scipy'],
+          'BiTreeAmericanOption': ['scipy'],
+          'MCEngine': ['scipy'],
+          'MCArithAsianOption': ['scipy'],
+          'MCArithBasketOption': ['scipy'],
+          'PriceCache': ['scipy']}
+
+
+def import_time(module):
+    """
+    Args:
+        module: the name of the module, importable from the directory of this file
+    Returns:
+        the cumulative import time of the module in milliseconds and the names of all the modules it imported
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                            check=True).stderr
+    # lines: "import time: self [us] | cumulative | imported package", nested imports indented
+    cumulative, imported = None, set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, total, name = line.split('|')
+        imported.add(name.strip())
+        if name.strip() == module and not name[1:].startswith(' '):
+            cumulative = int(total) / 1000
+    return cumulative, imported
+
+
+def check(modules=None, repeat=5, budget=None):
+    """
+    Args:
+        modules: the modules to check, all those of CHECKS by default
+        repeat: the number of fresh imports of every module, the fastest one is kept
+        budget: the maximal cumulative import time in milliseconds (None for no budget)
+    Returns:
+        the list of failures, empty when every module passes
+    """
+    failures = []
+    for module in modules or CHECKS:
+        runs = [import_time(module) for _ in range(repeat)]
+        cumulative = min(run[0] for run in runs)
+        imported = set().union(*(run[1] for run in runs))
+        deferred = [package for package in CHECKS.get(module, [])
+                    if any(name == package or name.startswith(package + '.') for name in imported)]
+        over = budget is not None and cumulative > budget
+        print('{:<22} {:8.1f} ms{}{}'.format(module, cumulative,
+                                             '  imports ' + ', '.join(deferred) if deferred else '',
+                                             '  over budget' if over else ''))
+        if deferred:
+            failures.append('{} imports {} at startup'.format(module, ', '.join(deferred)))
+        if over:
+            failures.append('{} takes {:.1f} ms to import, over {} ms'.format(module, cumulative, budget))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import-time regression check of the entry points.')
+    parser.add_argument('modules', nargs='*', help='the modules to check, all the entry points by default')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh imports of every module, the fastest is kept')
+    parser.add_argument('--budget', type=float, default=None, help='maximal cumulative import time in ms')
+    args = parser.parse_args()
+
+    failures = check(args.modules, args.repeat, args.budget)
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -2,9 +2,14 @@
 Implement the Monte Carlo method with control variate technique for arithmetic Asian call/put options.
 # @Author  :  Wu Bijia
 """
-from scipy.stats import norm
+from functools import partial
+import logging
+from SpecialFunctions import ncdf_scalar
 import numpy as np
-import sys
+from MCEngine import run_batches, run_adaptive, run_qmc, replication_estimate, plain_estimate, control_variate_estimate, \
+    BrownianBridge, ProgressReporter, MCResult
+
+logger = logging.getLogger(__name__)
 
 
 class MCArithAsianOption:
@@ -18,10 +23,31 @@ class MCArithAsianOption:
         n: the number of observation times for the option
         m: the number of paths in the Monte Carlo simulation
         option_type: 'call' or 'put'
-        ctrl_var: Using control variate or not
+        ctrl_var: Using control variate or not (the geometric Asian payoff)
+        seed: the seed of the random number generator
+        chunk_size: the number of paths simulated at once, bounding the memory used (None for all m)
+        workers: the number of processes simulating chunks (or replications) in parallel
+        sampling: 'pseudo' for pseudo-random normals, 'sobol' for randomized quasi-Monte Carlo
+        replications: the number of independent Sobol scrambles, whose spread gives the confidence interval
+        antithetic: simulate every draw of normals together with its negation and average the pair
+        moment_matching: shift and scale the normals of every chunk (of more than one row) to sample mean 0
+            and variance 1
+        controls: the control variates to regress on, any of 'geometric' (the geometric Asian payoff),
+            'terminal' (the discounted terminal price) and 'average' (the discounted average price);
+            None for ['geometric'] with ctrl_var and no control otherwise
+        target_ci: stop once the half-width of the 95% confidence interval is below it, m becoming a maximum
+        max_time: stop once the simulation has run that many seconds, m becoming a maximum
+        progress: callable receiving the progress of the simulation as a dict (paths, elapsed, paths_per_sec,
+            estimate, ci_width, final), e.g. MCEngine.log_progress; None for no reporting
+        progress_interval: the minimal number of seconds between two progress reports
+        cancel: a threading.Event stopping the simulation between two chunks once set, the pricing then raises
+            MCEngine.SimulationCancelled
     """
     def __init__(self, s0=None, sigma=None, r=0, T=0, K=None,
-                 n=100, m=100000, option_type=None, ctrl_var=False):
+                 n=100, m=100000, option_type=None, ctrl_var=False, seed=0,
+                 chunk_size=10000, workers=1,
+                 sampling='pseudo', replications=8, antithetic=False, moment_matching=False, controls=None,
+                 target_ci=None, max_time=None, progress=None, progress_interval=1.0, cancel=None):
 
         assert option_type == 'call' or option_type == 'put'
         self.s0 = s0
@@ -33,103 +59,251 @@ class MCArithAsianOption:
         self.m = m
         self.option_type = option_type
         self.ctrl_var = ctrl_var
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.workers = workers
+        assert sampling == 'pseudo' or sampling == 'sobol'
+        self.sampling = sampling
+        self.replications = replications
+        self.antithetic = antithetic
+        self.moment_matching = moment_matching
+        self.controls = controls
+        # adaptive stopping needs the running confidence interval of pseudo-random sampling
+        assert sampling == 'pseudo' or (target_ci is None and max_time is None)
+        self.target_ci = target_ci
+        self.max_time = max_time
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.cancel = cancel
+        # the variance of the plain estimator over that of the estimator used, per simulated path
+        self.variance_reduction = None
 
-    def pricing(self):
+    def __getstate__(self):
+
+        # the worker processes only simulate chunks: the progress callback and the cancel event stay in this one
+        return dict(self.__dict__, progress=None, cancel=None)
+
+    def _simulate_chunk(self, rng, size, greeks=False):
+
+        return self._sample(self._normals(rng, size), greeks)
+
+    def _normals(self, rng, size):
+
+        # the standard normals driving the increments of the paths, one row per antithetic pair
+        return rng.standard_normal((self._rows(size), self.n))
+
+    def _rows(self, size):
+
+        # the number of rows of normals simulating size paths
+        return (size + 1) // 2 if self.antithetic else size
+
+    def _normals_from_uniform(self, U):
+
+        # Sobol points -> normals, the leading dimensions building the path through a Brownian bridge
+        from scipy.special import ndtri
+        return BrownianBridge(self.n).increments(ndtri(U))
 
+    def _sample(self, Z, greeks=False):
+
+        # the payoffs of the paths driven by Z after the variance reduction transforms; with antithetic variates
+        # each row is the average over a pair, followed by the plain call and put payoffs of its first path
+        # a chunk of one row has no spread to match, it is left as drawn
+        if self.moment_matching and len(Z) > 1:
+            Z -= np.mean(Z, axis=0)
+            Z /= np.std(Z, axis=0)
+        if not self.antithetic:
+            return self._payoffs(Z, greeks)
+        X = self._payoffs(Z.copy(), greeks)
+        np.negative(Z, out=Z)
+        pair = self._payoffs(Z, greeks)
+        pair += X
+        pair *= 0.5
+        return np.hstack([pair, X[:, :2]])
+
+    def _payoffs(self, Z, greeks=False):
+
+        # columns: arithmetic call, arithmetic put, geometric call, geometric put (discounted payoffs),
+        # the discounted terminal and average prices, then with greeks the call/put pairs of delta, gamma,
+        # vega and rho; Z is overwritten
         n = self.n
-        m = self.m
         dt = self.T / n
+        size = Z.shape[0]
+        if greeks:
+            Z_1 = Z[:, 0].copy()
+
+        # build the log-paths from the cumulative sum of the log increments (in place)
+        Z *= self.sigma*np.sqrt(dt)
+        Z += (self.r - 0.5*self.sigma**2)*dt
+        np.cumsum(Z, axis=1, out=Z)
+        Z += np.log(self.s0)
+
+        ### Geometric mean
+        geoMean = np.exp(np.mean(Z, axis=1))
+        if greeks:
+            # dS_j/dsigma = S_j*(W_j - sigma*t_j), with the Brownian motion W_j recovered from the log-path
+            t = dt * np.arange(1, n+1)
+            dS_dsigma = (Z - np.log(self.s0) - (self.r + 0.5*self.sigma**2)*t) / self.sigma
+        ### Arithmatic mean
+        arithMean = np.mean(np.exp(Z, out=Z), axis=1)
+
+        payoffs = np.empty((size, 14 if greeks else 6))
+        np.maximum(arithMean-self.K, 0, out=payoffs[:, 0])
+        np.maximum(self.K-arithMean, 0, out=payoffs[:, 1])
+        np.maximum(geoMean-self.K, 0, out=payoffs[:, 2])
+        np.maximum(self.K-geoMean, 0, out=payoffs[:, 3])
+        payoffs[:, 4] = Z[:, -1]
+        payoffs[:, 5] = arithMean
+        payoffs[:, :6] *= np.exp(-self.r*self.T)
+
+        if greeks:
+            # pathwise derivatives of the discounted payoff w.r.t. the arithmetic mean, for the call and the put
+            dP_dA = np.exp(-self.r*self.T) * np.stack([arithMean > self.K, -1.0*(arithMean < self.K)], axis=1)
+            dS_dsigma *= Z
+            # delta, pathwise
+            payoffs[:, 6:8] = dP_dA * (arithMean / self.s0)[:, None]
+            # gamma, likelihood ratio of the first increment applied to the pathwise delta
+            payoffs[:, 8:10] = payoffs[:, 6:8] * (Z_1 / (self.s0*self.sigma*np.sqrt(dt)) - 1/self.s0)[:, None]
+            # vega, pathwise
+            payoffs[:, 10:12] = dP_dA * np.mean(dS_dsigma, axis=1)[:, None]
+            # rho, pathwise, including the discount factor
+            payoffs[:, 12:14] = dP_dA * np.mean(Z * t, axis=1)[:, None] - self.T * payoffs[:, 0:2]
+        return payoffs
+
+    def _geo_exact(self):
+
+        # closed-form prices of the geometric Asian call and put, the expectations of the control variates
+        n = self.n
         sigsqT = self.sigma**2 * self.T * (n+1) * (2*n+1) / (6*n**2)
         muT = 0.5*sigsqT + (self.r - 0.5*(self.sigma**2))*self.T*(n+1)/(2*n)
 
         d1 = (np.log(self.s0/self.K) + (muT + 0.5*sigsqT))/np.sqrt(sigsqT)
         d2 = d1 - np.sqrt(sigsqT)
 
-        N1 = norm.cdf(d1)
-        N2 = norm.cdf(d2)
-
-        N1_ = norm.cdf(-d1)
-        N2_ = norm.cdf(-d2)
-
-        drift = np.exp((self.r - 0.5*self.sigma**2)*dt)
-
-        arithPayoff_call = [0] * m
-        arithPayoff_put = [0] * m 
-        geoPayoff_call = [0] * m
-        geoPayoff_put = [0] * m   
-        
-        for i in range(m):
-                
-            # fix the initial seed/state of the random number generator so that the results from the program are reproducible
-            k = i+2*i+3*1+4*i+6*i
-            Z = np.random.seed(k)
-            Z = np.random.normal(0, 1, n)
-            Spath = [0] * n
-            growthFactor = drift * np.exp(self.sigma*np.sqrt(dt)*Z[0])
-            Spath[0] = self.s0 * growthFactor
-
-            for j in range(1, n):
-                growthFactor = drift * np.exp(self.sigma*np.sqrt(dt)*Z[j])
-                Spath[j] = Spath[j-1] * growthFactor
-
-            ### Arithmatic mean
-            arithMean = np.mean(Spath)
-            arithPayoff_call[i] = np.exp(-self.r*self.T) * max(arithMean-self.K, 0)
-            arithPayoff_put[i] = np.exp(-self.r*self.T) * max(self.K-arithMean, 0) 
-
-            ### Geometric mean
-            geoMean = np.exp((1/n) * sum(np.log(Spath)))
-            geoPayoff_call[i] = np.exp(-self.r*self.T) * max(geoMean-self.K, 0)
-            geoPayoff_put[i] = np.exp(-self.r*self.T) * max(self.K-geoMean, 0)   
-
-            if i % 50 == 0:
-                print('[INFO] The {}th random variables have been generated.'.format(i))
-
-        ### Standard Mente Carlo
-        Pmean_call = np.mean(arithPayoff_call)
-        Pstd_call = np.std(arithPayoff_call)
-        
-        Pmean_put = np.mean(arithPayoff_put)
-        Pstd_put = np.std(arithPayoff_put)
-        
-        # the 95% confidence interval for call option without control variate
-        confmc_call = (Pmean_call-1.96*Pstd_call/np.sqrt(m), Pmean_call+1.96*Pstd_call/np.sqrt(m))
-        # the 95% confidence interval for put option without control variate
-        confmc_put = (Pmean_put-1.96*Pstd_put/np.sqrt(m), Pmean_put+1.96*Pstd_put/np.sqrt(m))
-
-        if not self.ctrl_var and self.option_type == 'call':
-            
-            print('The {} option price using Mente Carlo WITHOUT control variate is {}'.format(self.option_type, Pmean_call))
-            return Pmean_call, confmc_call
-        
-        elif not self.ctrl_var and self.option_type == 'put':
-            
-            print('The {} option price using Mente Carlo WITHOUT control variate is {}'.format(self.option_type, Pmean_put))
-            return Pmean_put, confmc_put
-        
-        else:
-            ### Control Variate
-            conXY_call = np.mean(np.multiply(arithPayoff_call, geoPayoff_call)) - (np.mean(arithPayoff_call) * np.mean(geoPayoff_call))
-            conXY_put = np.mean(np.multiply(arithPayoff_put, geoPayoff_put)) - (np.mean(arithPayoff_put) * np.mean(geoPayoff_put))
-            theta_call = conXY_call / np.var(geoPayoff_call)
-            theta_put = conXY_put / np.var(geoPayoff_put) # for put
-
-            ### Control variate version
-            if self.option_type == 'call':
-                geo_call = np.exp(-self.r * self.T) * (self.s0 * np.exp(muT) * N1 - self.K * N2)
-                Z = arithPayoff_call + theta_call * (geo_call - geoPayoff_call)
-
-            elif self.option_type == 'put':
-                geo_put = np.exp(-self.r * self.T) * (self.K * N2_ - self.s0 * np.exp(muT) * N1_)
-                Z = arithPayoff_put + theta_put * (geo_put - geoPayoff_put)
-
-            Zmean = np.mean(Z)
-            Zstd = np.std(Z)
-            confmc = (Zmean-1.96 * Zstd / np.sqrt(m), Zmean+1.96*Zstd/np.sqrt(m))
-            print('The {} option price using Mente Carlo WITH control variate is {}'.format(self.option_type, Zmean))
-            return Zmean, confmc
+        N1 = ncdf_scalar(d1)
+        N2 = ncdf_scalar(d2)
+
+        N1_ = ncdf_scalar(-d1)
+        N2_ = ncdf_scalar(-d2)
+
+        geo_call = np.exp(-self.r * self.T) * (self.s0 * np.exp(muT) * N1 - self.K * N2)
+        geo_put = np.exp(-self.r * self.T) * (self.K * N2_ - self.s0 * np.exp(muT) * N1_)
+        return geo_call, geo_put
+
+    def _controls(self, col=None, controls=None):
+
+        # the columns of the control variates and their exact expectations, for the call (col 0) or the put (col 1)
+        if controls is None:
+            controls = self.controls if self.controls is not None else (['geometric'] if self.ctrl_var else [])
+        if col is None:
+            col = 0 if self.option_type == 'call' else 1
+        t = self.T / self.n * np.arange(1, self.n+1)
+        known = {'geometric': (col + 2, self._geo_exact()[col]),
+                 'terminal': (4, self.s0),
+                 'average': (5, self.s0 * np.exp(-self.r*self.T) * np.mean(np.exp(self.r*t)))}
+        return [known[name] for name in controls]
+
+    def _fit(self, acc, col, controls=None):
+
+        # price, per-path standard deviation, confidence interval and control coefficients of the call or the put
+        controls = self._controls(col, controls)
+        if not controls:
+            ### Standard Mente Carlo
+            Pmean, std, confmc = plain_estimate(acc, col)
+            return Pmean, std, confmc, None
+        ### Control variate version
+        columns, exact = zip(*controls)
+        return control_variate_estimate(acc, col, list(columns), list(exact))
+
+    def _estimate(self, acc):
+
+        col = 0 if self.option_type == 'call' else 1
+        Pmean, std, confmc, _ = self._fit(acc, col)
+        # the plain per-path variance, from the first path of each pair with antithetic variates
+        plain = acc.cov()[col - 2, col - 2] if self.antithetic else acc.cov()[col, col]
+        self.variance_reduction = plain / ((2 if self.antithetic else 1) * std**2) if std > 0 else np.inf
+        return Pmean, confmc
+
+    def _reporter(self):
+
+        if self.progress is None:
+            return None
+        return ProgressReporter(self.progress, self._estimate, self.progress_interval, 2 if self.antithetic else 1)
+
+    def _simulate(self, greeks=False):
+
+        # running moments of the payoffs: one accumulator with pseudo-random sampling, one per replication with Sobol
+        if self.sampling == 'sobol':
+            m = (self.m + 1) // 2 if self.antithetic else self.m
+            return run_qmc(partial(self._sample, greeks=greeks), self._normals_from_uniform, self.n, m,
+                           self.chunk_size, self.seed, self.replications, self.workers, self._reporter(),
+                           self.cancel)
+        if self.target_ci is not None or self.max_time is not None:
+            return [run_adaptive(partial(self._simulate_chunk, greeks=greeks), self._estimate, self.m, self.chunk_size,
+                                 self.seed, self.target_ci, self.max_time, self.workers, self._reporter(),
+                                 self.cancel)]
+        return [run_batches(partial(self._simulate_chunk, greeks=greeks), self.m, self.chunk_size, self.seed, self.workers,
+                            self._reporter(), self.cancel)]
+
+    def _combine(self, accs):
+
+        # with Sobol the confidence interval comes from the spread of the independent replications
+        if len(accs) == 1:
+            return self._estimate(accs[0])
+        price, _, confmc = replication_estimate([self._estimate(acc)[0] for acc in accs])
+        return price, confmc
+
+    def pricing(self):
+
+        # simulate the paths chunk by chunk, keeping only running moments of the payoffs
+        price, confmc = self._combine(self._simulate())
+        logger.info('The %s option price using Mente Carlo %s control variate is %s',
+                    self.option_type, 'WITH' if self._controls() else 'WITHOUT', price)
+        return price, confmc
+
+    def results(self):
+
+        # call and put, without and with control variates (the geometric one unless controls are given),
+        # all estimated from one simulation
+        accs = self._simulate()
+        controls = self.controls or ['geometric']
+        result = MCResult(sum(acc.count for acc in accs) * (2 if self.antithetic else 1))
+        for col, option_type in enumerate(['call', 'put']):
+            for estimator, names in [('plain', []), ('control_variate', controls)]:
+                fits = [self._fit(acc, col, names) for acc in accs]
+                if len(accs) == 1:
+                    price, std, conf, beta = fits[0]
+                    stderr = std / np.sqrt(accs[0].count)
+                else:
+                    # Sobol: the spread of the replications, and their average coefficients
+                    price, stderr, conf = replication_estimate([fit[0] for fit in fits])
+                    beta = None if fits[0][3] is None else np.mean([fit[3] for fit in fits], axis=0)
+                result.add(option_type, estimator, price, stderr, conf, beta)
+        return result
+
+    def greeks(self):
+
+        # the price and its delta, gamma, vega and rho estimated from the same simulated paths
+        accs = self._simulate(greeks=True)
+        price, _ = self._combine(accs)
+        mean = np.mean([acc.mean for acc in accs], axis=0)
+        col = 0 if self.option_type == 'call' else 1
+        return {'price': price, 'delta': mean[6+col], 'gamma': mean[8+col],
+                'vega': mean[10+col], 'rho': mean[12+col]}
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     option = MCArithAsianOption(s0=100, sigma=0.3, r=0.05, T=3, K=100,
                  n=100, m=100000, option_type='call', ctrl_var=False)
     option.pricing()
+
+    # variance reduction factor achieved by each mode, per simulated path
+    for modes in [{'antithetic': True}, {'moment_matching': True}, {'ctrl_var': True},
+                  {'controls': ['geometric', 'terminal', 'average']},
+                  {'antithetic': True, 'controls': ['geometric', 'terminal', 'average']}]:
+        option = MCArithAsianOption(s0=100, sigma=0.3, r=0.05, T=3, K=100,
+                     n=100, m=100000, option_type='call', **modes)
+        option.pricing()
+        print('{}: variance reduction factor {:.1f}'.format(modes, option.variance_reduction))
+
+    # call and put, with and without control variate, from a single simulation
+    print(option.results())
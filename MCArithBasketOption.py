@@ -1,11 +1,17 @@
 """
 Implement the Monte Carlo method with control variate technique for arithmetic mean basket call/put options.
-For the arithmetic mean basket options, we only need to consider a basket with two assets.
+The basket holds two assets (s0_1, s0_2, sigma_1, sigma_2, rho) or N assets (s0, sigma, corr, weights),
+observed at maturity or averaged over n equally spaced observation times (an Asian basket).
 # @Author  :  Wu Bijia
 """
-from scipy.stats import norm
+from functools import partial
+import logging
 import numpy as np
 from CFGeoBasketOption import CFGeoBasketOption
+from MCEngine import run_batches, run_adaptive, run_qmc, replication_estimate, plain_estimate, control_variate_estimate, \
+    BrownianBridge, ProgressReporter, MCResult
+
+logger = logging.getLogger(__name__)
 
 
 class MCArithBasketOption(CFGeoBasketOption):
@@ -21,145 +27,306 @@ class MCArithBasketOption(CFGeoBasketOption):
         rho: the correlation
         option_type: 'call' or 'put'
         m: The number of path in the Monte Carlo simulation
-        ctrl_var: Using control variate or not
+        ctrl_var: Using control variate or not (the geometric basket payoff)
+        seed: the seed of the random number generator
+        chunk_size: the number of paths simulated at once, bounding the memory used (None for all m)
+        workers: the number of processes simulating chunks (or replications) in parallel
+        sampling: 'pseudo' for pseudo-random normals, 'sobol' for randomized quasi-Monte Carlo
+        replications: the number of independent Sobol scrambles, whose spread gives the confidence interval
+        antithetic: simulate every draw of normals together with its negation and average the pair
+        moment_matching: shift and scale the normals of every chunk (of more than one row) to sample mean 0
+            and variance 1
+        controls: the control variates to regress on, any of 'geometric' (the geometric basket payoff)
+            and 'underlying' (the discounted terminal prices of the assets);
+            None for ['geometric'] with ctrl_var and no control otherwise
+        target_ci: stop once the half-width of the 95% confidence interval is below it, m becoming a maximum
+        max_time: stop once the simulation has run that many seconds, m becoming a maximum
+        progress: callable receiving the progress of the simulation as a dict (paths, elapsed, paths_per_sec,
+            estimate, ci_width, final), e.g. MCEngine.log_progress; None for no reporting
+        progress_interval: the minimal number of seconds between two progress reports
+        s0: Spot Prices of the N assets, replacing s0_1 and s0_2
+        sigma: Volatilities of the N assets, replacing sigma_1 and sigma_2
+        corr: the N x N correlation matrix, replacing rho
+        weights: the weights of the assets in the basket, equal weights 1/N by default
+        n: the number of observation times, 1 for the basket at maturity only; every chunk holds
+            chunk_size x n x N normals
+        cancel: a threading.Event stopping the simulation between two chunks once set, the pricing then raises
+            MCEngine.SimulationCancelled
     """
     def __init__(self, s0_1=None, s0_2=None, sigma_1=None, sigma_2=None,
                  r=0, T=0, K=None, rho=None, option_type=None, m=100000,
-                 ctrl_var=False):
+                 ctrl_var=False, seed=0, chunk_size=10000, workers=1,
+                 sampling='pseudo', replications=8, antithetic=False, moment_matching=False, controls=None,
+                 target_ci=None, max_time=None, progress=None, progress_interval=1.0, s0=None, sigma=None, corr=None, weights=None, n=1,
+                 cancel=None):
 
         CFGeoBasketOption.__init__(self, s0_1, s0_2, sigma_1, sigma_2, r, T,
-                                    K, rho, option_type)
+                                    K, rho, option_type, s0, sigma, corr, weights, n)
         self.m = m
         self.ctrl_var = ctrl_var
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.workers = workers
+        assert sampling == 'pseudo' or sampling == 'sobol'
+        self.sampling = sampling
+        self.replications = replications
+        self.antithetic = antithetic
+        self.moment_matching = moment_matching
+        self.controls = controls
+        # adaptive stopping needs the running confidence interval of pseudo-random sampling
+        assert sampling == 'pseudo' or (target_ci is None and max_time is None)
+        self.target_ci = target_ci
+        self.max_time = max_time
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.cancel = cancel
+        # the variance of the plain estimator over that of the estimator used, per simulated path
+        self.variance_reduction = None
+        self._cached_factor = None
+
+    def __getstate__(self):
+
+        # the worker processes only simulate chunks: the progress callback and the cancel event stay in this one
+        return dict(self.__dict__, progress=None, cancel=None)
+
+    def _simulate_chunk(self, rng, size, greeks=False):
+
+        return self._sample(self._normals(rng, size), greeks)
+
+    def _normals(self, rng, size):
+
+        # independent standard normals (paths x times x assets), correlated in _payoffs, one row per antithetic pair
+        return rng.standard_normal((self._rows(size), self.n, len(self.Assets()[0])))
+
+    def _rows(self, size):
+
+        # the number of rows of normals simulating size paths
+        return (size + 1) // 2 if self.antithetic else size
+
+    def _normals_from_uniform(self, U):
+
+        # Sobol points -> independent standard normals, the leading dimensions building the paths of the assets
+        # through a Brownian bridge
+        from scipy.special import ndtri
+        N = len(self.Assets()[0])
+        Z = ndtri(U).reshape(-1, self.n, N).transpose(0, 2, 1).reshape(-1, self.n)
+        return BrownianBridge(self.n).increments(Z).reshape(-1, N, self.n).transpose(0, 2, 1)
+
+    def _sample(self, X, greeks=False):
+
+        # the payoffs of the paths driven by X after the variance reduction transforms; with antithetic variates
+        # each row is the average over a pair, followed by the plain call and put payoffs of its first path
+        # a chunk of one row has no spread to match, it is left as drawn
+        if self.moment_matching and len(X) > 1:
+            X -= np.mean(X, axis=0)
+            X /= np.std(X, axis=0)
+        if not self.antithetic:
+            return self._payoffs(X, greeks)
+        P = self._payoffs(X, greeks)
+        pair = self._payoffs(-X, greeks)
+        pair += P
+        pair *= 0.5
+        return np.hstack([pair, P[:, :2]])
+
+    def _factor(self, corr):
+
+        # factor L of the correlation matrix, corr = L L^T, cached across the chunks; the eigen-decomposition
+        # stands in for the Cholesky factorization when corr is only semi-definite
+        if self._cached_factor is None or not np.array_equal(self._cached_factor[0], corr):
+            try:
+                L = np.linalg.cholesky(corr)
+            except np.linalg.LinAlgError:
+                w, V = np.linalg.eigh(corr)
+                L = V * np.sqrt(np.clip(w, 0, None))
+            self._cached_factor = (corr, L)
+        return self._cached_factor[1]
+
+    def _payoffs(self, X, greeks=False):
+
+        # columns: arithmetic call, arithmetic put, geometric call, geometric put (discounted payoffs),
+        # the discounted terminal prices of the N assets, then with greeks the call/put pairs of the deltas,
+        # gammas and vegas of the N assets, and of rho
+        s0, sigma, corr, weights = self.Assets()
+        N = len(s0)
+        size, n = X.shape[0], X.shape[1]
+        dt = self.T / n
+        # X: (paths x times x assets) i.i.d standard normals, Y = X L^T the correlated increments of all the paths
+        Y = X @ self._factor(corr).T
+        # build the log-paths from the cumulative sum of the log increments along the times
+        logS = Y * (sigma*np.sqrt(dt))
+        logS += (self.r - 0.5*sigma**2)*dt
+        np.cumsum(logS, axis=1, out=logS)
+        logS += np.log(s0)
+        S = np.exp(logS)
+
+        # the basket averaged over the times and the assets
+        Ba = np.mean(S @ weights, axis=1)
+        ### Geometric mean
+        geoMean = np.exp(np.mean(logS @ weights, axis=1))
+
+        payoffs = np.empty((size, 6 + 7*N if greeks else 4 + N))
+        np.maximum(Ba-self.K, 0, out=payoffs[:, 0])
+        np.maximum(self.K-Ba, 0, out=payoffs[:, 1])
+        np.maximum(geoMean-self.K, 0, out=payoffs[:, 2])
+        np.maximum(self.K-geoMean, 0, out=payoffs[:, 3])
+        payoffs[:, 4:4+N] = S[:, -1]
+        payoffs[:, :4+N] *= np.exp(-self.r*self.T)
+
+        if greeks:
+            t = (dt * np.arange(1, n+1))[:, None]
+            # pathwise derivatives of the discounted payoff w.r.t. the basket, for the call and the put
+            discount = np.exp(-self.r*self.T)
+            # score of the first correlated increments w.r.t. the spot prices, for the likelihood ratio gammas
+            score = (Y[:, 0] @ np.linalg.pinv(corr)) / (s0*sigma*np.sqrt(dt))
+            # time averages of S_i and of dS_i/dsigma_i = S_i*(W_i - sigma_i*t), with W_i the Brownian motions
+            meanS = np.mean(S, axis=1)
+            dS_dsigma = np.mean(S * (np.sqrt(dt)*np.cumsum(Y, axis=1) - sigma*t), axis=1)
+            dB_dr = np.mean((S @ weights) * t[:, 0], axis=1)
+            for k, dP_dB in enumerate([discount*(Ba > self.K), -discount*(Ba < self.K)]):
+                dP_dB = dP_dB[:, None]
+                delta = dP_dB * weights * meanS / s0
+                payoffs[:, 4+N+k*N:4+2*N+k*N] = delta
+                # gamma, likelihood ratio applied to the pathwise delta
+                payoffs[:, 4+3*N+k*N:4+4*N+k*N] = delta * (score - 1/s0)
+                # vega, pathwise
+                payoffs[:, 4+5*N+k*N:4+6*N+k*N] = dP_dB * weights * dS_dsigma
+                # rho, pathwise, including the discount factor
+                payoffs[:, 4+7*N+k] = dP_dB[:, 0] * dB_dr - self.T * payoffs[:, k]
+        return payoffs
+
+    def _controls(self, col=None, controls=None):
+
+        # the columns of the control variates and their exact expectations, for the call (col 0) or the put (col 1),
+        # the closed-form geometric basket price is the expectation of the geometric control
+        if controls is None:
+            controls = self.controls if self.controls is not None else (['geometric'] if self.ctrl_var else [])
+        if col is None:
+            col = 0 if self.option_type == 'call' else 1
+        known = {'geometric': [(col + 2, self.CallGeoBasket() if col == 0 else self.PutGeoBasket())],
+                 'underlying': [(4 + i, s0) for i, s0 in enumerate(self.Assets()[0])]}
+        return [control for name in controls for control in known[name]]
+
+    def _fit(self, acc, col, controls=None):
+
+        # price, per-path standard deviation, confidence interval and control coefficients of the call or the put
+        controls = self._controls(col, controls)
+        if not controls:
+            ### Standard Mente Carlo
+            Pmean, std, confmc = plain_estimate(acc, col)
+            return Pmean, std, confmc, None
+        ### Control variate version
+        columns, exact = zip(*controls)
+        return control_variate_estimate(acc, col, list(columns), list(exact))
+
+    def _estimate(self, acc):
+
+        col = 0 if self.option_type == 'call' else 1
+        Pmean, std, confmc, _ = self._fit(acc, col)
+        # the plain per-path variance, from the first path of each pair with antithetic variates
+        plain = acc.cov()[col - 2, col - 2] if self.antithetic else acc.cov()[col, col]
+        self.variance_reduction = plain / ((2 if self.antithetic else 1) * std**2) if std > 0 else np.inf
+        return float(Pmean), confmc
+
+    def _reporter(self):
+
+        if self.progress is None:
+            return None
+        return ProgressReporter(self.progress, self._estimate, self.progress_interval, 2 if self.antithetic else 1)
+
+    def _simulate(self, greeks=False):
+
+        # running moments of the payoffs: one accumulator with pseudo-random sampling, one per replication with Sobol
+        if self.sampling == 'sobol':
+            m = (self.m + 1) // 2 if self.antithetic else self.m
+            return run_qmc(partial(self._sample, greeks=greeks), self._normals_from_uniform, self.n * len(self.Assets()[0]), m,
+                           self.chunk_size, self.seed, self.replications, self.workers, self._reporter(),
+                           self.cancel)
+        if self.target_ci is not None or self.max_time is not None:
+            return [run_adaptive(partial(self._simulate_chunk, greeks=greeks), self._estimate, self.m, self.chunk_size,
+                                 self.seed, self.target_ci, self.max_time, self.workers, self._reporter(),
+                                 self.cancel)]
+        return [run_batches(partial(self._simulate_chunk, greeks=greeks), self.m, self.chunk_size, self.seed, self.workers,
+                            self._reporter(), self.cancel)]
+
+    def _combine(self, accs):
+
+        # with Sobol the confidence interval comes from the spread of the independent replications
+        if len(accs) == 1:
+            return self._estimate(accs[0])
+        price, _, confmc = replication_estimate([self._estimate(acc)[0] for acc in accs])
+        return float(price), confmc
 
     """
     Args:
-        num_randoms: The observation time in Mente Carlo Process
+        num_randoms: The number of observation times in Mente Carlo Process, None to keep n
     """
-    def pricing(self, num_randoms=50):
-
-        # n is number of baskets in the Mean Basket Options
-        n = 2
-        m = self.m
-        dt = self.T / num_randoms
-        # Calculate SigmaBg Square
-        sigsqT = (self.sigma_1**2+2*self.sigma_1*self.sigma_2*self.rho+self.sigma_2**2)/(n**2)
-        # mu multiply by T
-        muT = (self.r - 0.5*((self.sigma_1**2+self.sigma_2**2)/n) + 0.5*sigsqT)*self.T
-
-        Bg = [0] * m
-        Ba = [0] * m
-        Bg0 = np.sqrt(self.s0_1 * self.s0_2)
-
-        d1 = (np.log(Bg0/self.K) + (muT + 0.5*sigsqT*self.T))/(np.sqrt(sigsqT)*np.sqrt(self.T))
-        d2 = d1 - np.sqrt(sigsqT)*np.sqrt(self.T)
-
-        N1 = norm.cdf(d1)
-        N2 = norm.cdf(d2)
-
-        N1_ = norm.cdf(-d1)
-        N2_ = norm.cdf(-d2)
-
-        drift_1 = np.exp((self.r - 0.5 * self.sigma_1 ** 2) * self.T)
-        drift_2 = np.exp((self.r - 0.5 * self.sigma_2 ** 2) * self.T)
-
-        arithPayoff = [0] * m
-        geoPayoff_call = [0] * m
-        geoPayoff_put = [0] * m
-
-        for i in range(m):
-
-            #Bg[0] = Bg0
-            #Ba[0] = 0.5*(Spath_1[0]+Spath_2[0])
-
-            # fix the initial state
-            s = i + 2*i
-            np.random.seed(s)
-            Z_1 = np.random.normal(0, 1, 1)
-            # mu = 0, sigma = 1, X1, X2 are i.i.d
-            # Y1 = mu + sigmaX1, Y2 = mu + sigma(rhoX1 + sqrt(1-rho**2*X2))
-            Z_2 = self.rho*Z_1+np.sqrt(1-self.rho**2)*np.random.normal(0, 1, 1)
-            S_1 = self.s0_1*drift_1 * np.exp(self.sigma_1 * np.sqrt(self.T) * Z_1)
-            S_2 = self.s0_2*drift_2 * np.exp(self.sigma_2 * np.sqrt(self.T) * Z_2)
-            
-            '''
-            Spath_1 = [0]*50
-            Spath_2 = [0]*50
-            Spath_1[0] =  self.s0_1*drift_1 * np.exp(self.sigma_1 * np.sqrt(self.T) * Z_1_o)
-            for j in range(1, 50):
-                
-                Z_1 = np.random.normal(0, 1, 1)
-                Z_2 = np.random.normal(0, 1, 1)
-                Spath_1[0] = self.s0_1*drift_1 * np.exp(self.sigma_1 * np.sqrt(self.T) * Z_1)
-                Spath_2[0] = self.s0_2*drift_2 * np.exp(self.sigma_2 * np.sqrt(self.T) * Z_2)
-                growthFactor_1 = drift_11 * np.exp(self.sigma_1 * np.sqrt(dt) * Z_1)
-                growthFactor_2 = drift_21 * np.exp(self.sigma_2 * np.sqrt(dt) * Z_2)
-                Spath_1[j] = Spath_1[j - 1] * growthFactor_1
-                Spath_2[j] = Spath_2[j - 1] * growthFactor_2
-                #Bg[j] = np.sqrt(Spath_1[j]*Spath_2[j])
-            '''
-            
-            Ba[i] = (1/n)*(S_1 + S_2)
-            ### Geometric mean
-            geoMean = np.exp((1/n) * (np.log(S_1) + np.log(S_2)))
-            geoPayoff_call[i] = np.exp(-self.r*self.T)*max(geoMean-self.K, 0)
-            geoPayoff_put[i] = np.exp(-self.r*self.T)*max(self.K-geoMean, 0)
-
-            if i % 50 == 0:
-                print('[INFO] The {} path has been generated.'.format(i))
-                 
-            if self.option_type == "call":
-                
-                arithPayoff[i] = Ba[i] - self.K
-                if arithPayoff[i] > 0:
-                    arithPayoff[i] = np.exp(-self.r*self.T)*arithPayoff[i]
-                else:
-                    arithPayoff[i] = 0
+    def pricing(self, num_randoms=None):
 
-            elif self.option_type == "put":
+        if num_randoms is not None:
+            self.n = num_randoms
 
-                arithPayoff[i] = self.K - Ba[i]
-                if arithPayoff[i] > 0:
-                    arithPayoff[i] = np.exp(-self.r*self.T)*arithPayoff[i]
-                else:
-                    arithPayoff[i] = 0
-                
-        ### Standard Mente Carlo
-        Pmean = float(np.mean(arithPayoff))
-        Pstd = np.std(arithPayoff)
-        confmc = (Pmean-1.96*Pstd/np.sqrt(m), Pmean+1.96*Pstd/np.sqrt(m))
-
-        if not self.ctrl_var:
-            print('The {} basket option price using Mente Carlo WITHOUT control variate is {}'.format(self.option_type, Pmean))
-            print('The confidence interval is {}'.format(confmc))
-            return Pmean, confmc
+        # simulate the paths chunk by chunk, keeping only running moments of the payoffs
+        price, confmc = self._combine(self._simulate())
+        if not self._controls():
+            logger.info('The %s basket option price using Mente Carlo WITHOUT control variate is %s', self.option_type, price)
         else:
-            ### Control Variate
-            conXY_call = np.mean(np.multiply(arithPayoff, geoPayoff_call)) - (np.mean(arithPayoff) * np.mean(geoPayoff_call))
-            theta_call = conXY_call / np.var(geoPayoff_call)
-            conXY_put = np.mean(np.multiply(arithPayoff, geoPayoff_put)) - (np.mean(arithPayoff) * np.mean(geoPayoff_put))
-            theta_put = conXY_put / np.var(geoPayoff_put)
-
-            ### Control variate version
-            if self.option_type == 'call':
-                # implement the closed-from formula for Geometric Mean Basket Call Option
-                geo_call = np.exp(-self.r * self.T) * (Bg0 * np.exp(muT) * N1 - self.K * N2)
-                Z = arithPayoff + theta_call * (geo_call - geoPayoff_call)
-
-            elif self.option_type == 'put':
-                # implement the closed-from formula for Geometric Mean Basket Put Option
-                geo_put = np.exp(-self.r * self.T) * (self.K * N2_ - Bg0 * np.exp(muT) * N1_)
-                Z = arithPayoff + theta_put * (geo_put - geoPayoff_put)
-
-            Zmean = np.mean(Z)
-            Zstd = np.std(Z)
-            confmc = (Zmean-1.96 * Zstd / np.sqrt(m), Zmean+1.96*Zstd/np.sqrt(m))
-            print('The {} option price using Mente Carlo WITH control variate is {}'.format(self.option_type, Zmean))
-            print('The confidence interval is {}'.format(confmc))
-            return Zmean, confmc
+            logger.info('The %s option price using Mente Carlo WITH control variate is %s', self.option_type, price)
+        logger.info('The confidence interval is %s', confmc)
+        return price, confmc
+
+    def results(self):
+
+        # call and put, without and with control variates (the geometric one unless controls are given),
+        # all estimated from one simulation
+        accs = self._simulate()
+        controls = self.controls or ['geometric']
+        result = MCResult(sum(acc.count for acc in accs) * (2 if self.antithetic else 1))
+        for col, option_type in enumerate(['call', 'put']):
+            for estimator, names in [('plain', []), ('control_variate', controls)]:
+                fits = [self._fit(acc, col, names) for acc in accs]
+                if len(accs) == 1:
+                    price, std, conf, beta = fits[0]
+                    stderr = std / np.sqrt(accs[0].count)
+                else:
+                    # Sobol: the spread of the replications, and their average coefficients
+                    price, stderr, conf = replication_estimate([fit[0] for fit in fits])
+                    beta = None if fits[0][3] is None else np.mean([fit[3] for fit in fits], axis=0)
+                result.add(option_type, estimator, price, stderr, conf, beta)
+        return result
+
+    def greeks(self):
+
+        # the price, the deltas, gammas and vegas of the assets and rho, estimated from the same simulated paths
+        accs = self._simulate(greeks=True)
+        price, _ = self._combine(accs)
+        mean = np.mean([acc.mean for acc in accs], axis=0)
+        N = len(self.Assets()[0])
+        k = 0 if self.option_type == 'call' else 1
+        return {'price': price, 'delta': mean[4+N+k*N:4+2*N+k*N], 'gamma': mean[4+3*N+k*N:4+4*N+k*N],
+                'vega': mean[4+5*N+k*N:4+6*N+k*N], 'rho': mean[4+7*N+k]}
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     option = MCArithBasketOption(s0_1=100, s0_2=100, sigma_1=0.3, sigma_2=0.3,
                  r=0.05, T=3, K=100, rho=0.5, option_type='call', m=100000,
                  ctrl_var=True)
-    option.pricing(num_randoms=50)
+    option.pricing()
+
+    # a 50-name basket with a random correlation matrix, 1M paths in chunks
+    import time
+    n = 50
+    A = np.random.default_rng(0).standard_normal((n, n))
+    option = MCArithBasketOption(r=0.05, T=1, K=100, option_type='call', m=1000000, ctrl_var=True,
+                 s0=np.full(n, 100.0), sigma=np.full(n, 0.3), corr=np.corrcoef(A @ A.T + n*np.eye(n)))
+    start = time.perf_counter()
+    option.pricing()
+    print('{} assets x {} paths in {:.2f}s'.format(n, option.m, time.perf_counter() - start))
+
+    # the same basket averaged over 12 monthly observation times, 100k paths
+    option.n, option.m = 12, 100000
+    start = time.perf_counter()
+    option.pricing()
+    print('{} assets x {} times x {} paths in {:.2f}s'.format(n, option.n, option.m, time.perf_counter() - start))
+
+    # call and put, with and without control variate, from a single simulation
+    print(option.results())
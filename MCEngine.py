@@ -0,0 +1,392 @@
+"""
+Chunked Monte Carlo engine shared by the arithmetic Asian and basket pricers.
+Paths are simulated chunk by chunk and only running moments are kept, so memory stays constant in m.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from itertools import repeat
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MomentAccumulator:
+    """
+    Running count, means and co-moments of k per-path quantities.
+
+    Args:
+        k: the number of quantities simulated for every path
+    """
+    def __init__(self, k):
+
+        self.count = 0
+        self.mean = np.zeros(k)
+        # sum of (x - mean)(y - mean) over the paths seen so far
+        self.comoment = np.zeros((k, k))
+
+    def update(self, X):
+
+        # X: (paths x k) array of the quantities simulated for one chunk
+        chunk = MomentAccumulator(X.shape[1])
+        chunk.count = X.shape[0]
+        chunk.mean = np.mean(X, axis=0)
+        D = X - chunk.mean
+        chunk.comoment = D.T @ D
+        return self.merge(chunk)
+
+    def merge(self, other):
+
+        # pairwise update of Chan, Golub and LeVeque, stable for very large path counts
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment += other.comoment + np.outer(delta, delta) * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        return self
+
+    def cov(self):
+
+        # population covariance, consistent with np.std/np.var
+        return self.comoment / self.count
+
+
+class ProgressReporter:
+    """
+    Reports the progress of a simulation to a callback, at most once every interval seconds.
+
+    Args:
+        callback: callable receiving a dict with the paths done, the elapsed seconds, the paths per second,
+            the running estimate and the width of its 95% confidence interval
+        estimate: callable (accumulator) -> (price, confidence interval)
+        interval: the minimal number of seconds between two reports, 0 to report after every chunk
+        paths_per_row: the number of paths behind every accumulated row (2 with antithetic variates)
+    """
+    def __init__(self, callback, estimate, interval=1.0, paths_per_row=1):
+
+        self.callback = callback
+        self.estimate = estimate
+        self.interval = interval
+        self.paths_per_row = paths_per_row
+        self.start = time.perf_counter()
+        self.last = None
+
+    def __call__(self, acc, final=False):
+
+        now = time.perf_counter()
+        if not final and self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+        price, (low, high) = self.estimate(acc)
+        elapsed = now - self.start
+        paths = acc.count * self.paths_per_row
+        self.callback({'paths': paths, 'elapsed': elapsed, 'paths_per_sec': paths / elapsed if elapsed > 0 else 0.0,
+                       'estimate': price, 'ci_width': high - low, 'final': final})
+
+
+class SimulationCancelled(Exception):
+    """
+    Raised by the simulation loops when their cancel event is set.
+    """
+
+
+def _check(cancel):
+
+    if cancel is not None and cancel.is_set():
+        raise SimulationCancelled('the simulation was cancelled')
+
+
+def log_progress(info):
+
+    # a progress callback writing to the MCEngine logger
+    logger.info('%d paths in %.2fs (%.0f paths/s), estimate %.6f, CI width %.6f',
+                info['paths'], info['elapsed'], info['paths_per_sec'], info['estimate'], info['ci_width'])
+
+
+def _run_chunk(simulate_chunk, size, seed_seq):
+
+    # simulate one chunk on its own independent stream and reduce it to its moments
+    X = simulate_chunk(np.random.default_rng(seed_seq), size)
+    return MomentAccumulator(X.shape[1]).update(X)
+
+
+def _positive(m):
+
+    # without a single path there are no moments to estimate from
+    if not m > 0:
+        raise ValueError('m must be positive')
+
+
+def chunk_plan(m, chunk_size, seed):
+
+    # sizes of the chunks and their seeds; every chunk draws from its own child stream,
+    # so the result does not depend on which process simulates it
+    chunk_size = m if chunk_size is None else chunk_size
+    sizes = [min(chunk_size, m - start) for start in range(0, m, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return sizes, seeds
+
+
+def run_batches(simulate_chunk, m, chunk_size, seed, workers=1, progress=None, cancel=None):
+    """
+    Args:
+        simulate_chunk: callable (rng, size) -> (size x k) array of per-path quantities
+        m: the number of paths in the Monte Carlo simulation
+        chunk_size: the number of paths simulated at once (None for all of them)
+        seed: the seed of the random number generator
+        workers: the number of processes simulating chunks in parallel
+        progress: a ProgressReporter called after every chunk, None for no reporting
+        cancel: a threading.Event checked after every chunk, SimulationCancelled is raised once it is set
+    """
+    _positive(m)
+    sizes, seeds = chunk_plan(m, chunk_size, seed)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    args = (repeat(simulate_chunk), sizes, seeds)
+    acc = None
+    try:
+        for chunk in (executor.map(_run_chunk, *args) if executor else map(_run_chunk, *args)):
+            acc = chunk if acc is None else acc.merge(chunk)
+            if progress is not None:
+                progress(acc)
+            _check(cancel)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    if progress is not None:
+        progress(acc, final=True)
+    return acc
+
+
+def run_adaptive(simulate_chunk, estimate, m, chunk_size, seed, target_ci=None, max_time=None, workers=1,
+                 progress=None, cancel=None):
+    """
+    Simulates the chunks of run_batches in order, re-estimating after every chunk (every wave of chunks with
+    several workers), and stops as soon as the 95% half-width reaches target_ci or max_time has elapsed.
+
+    Args:
+        simulate_chunk: callable (rng, size) -> (size x k) array of per-path quantities
+        estimate: callable (accumulator) -> (price, confidence interval)
+        m: the maximal number of paths
+        chunk_size: the number of paths simulated between two checks
+        seed: the seed of the random number generator
+        target_ci: the target half-width of the 95% confidence interval (None for no target)
+        max_time: the time budget in seconds (None for no budget)
+        workers: the number of processes simulating chunks in parallel
+        progress: a ProgressReporter called after every chunk, None for no reporting
+        cancel: a threading.Event checked after every chunk, SimulationCancelled is raised once it is set
+    """
+    _positive(m)
+    start = time.perf_counter()
+    sizes, seeds = chunk_plan(m, chunk_size, seed)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    acc = None
+    try:
+        for wave in range(0, len(sizes), workers):
+            args = (repeat(simulate_chunk), sizes[wave:wave+workers], seeds[wave:wave+workers])
+            for chunk in (executor.map(_run_chunk, *args) if executor else map(_run_chunk, *args)):
+                acc = chunk if acc is None else acc.merge(chunk)
+                if progress is not None:
+                    progress(acc)
+                _check(cancel)
+            # the moments, hence the control variate coefficients, are updated online
+            low, high = estimate(acc)[1]
+            if target_ci is not None and (high - low) / 2 <= target_ci:
+                break
+            if max_time is not None and time.perf_counter() - start >= max_time:
+                break
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    if progress is not None:
+        progress(acc, final=True)
+    return acc
+
+
+class BrownianBridge:
+    """
+    Brownian bridge construction of a path on n equally spaced observation times: the first normal fixes the
+    terminal value, the next ones the midpoints, so the leading (best distributed) QMC dimensions carry
+    most of the variance of the path.
+
+    Args:
+        n: the number of observation times
+    """
+    def __init__(self, n):
+
+        t = np.arange(1, n+1, dtype=float)
+        filled = np.zeros(n, dtype=bool)
+        filled[n-1] = True
+        # for every normal i: the point it builds, its left/right neighbours and the interpolation weights
+        self.bridge, self.left, self.right = [n-1], [0], [0]
+        self.left_weight, self.right_weight, self.std = [0.0], [0.0], [np.sqrt(t[n-1])]
+
+        j = 0
+        for i in range(1, n):
+            while filled[j]:
+                j += 1
+            k = j
+            while not filled[k]:
+                k += 1
+            # points j..k-1 are still free, k is built; take the middle one
+            l = j + ((k - 1 - j) >> 1)
+            filled[l] = True
+            t_left = t[j-1] if j > 0 else 0.0
+            self.bridge.append(l)
+            self.left.append(j)
+            self.right.append(k)
+            self.left_weight.append((t[k] - t[l]) / (t[k] - t_left))
+            self.right_weight.append((t[l] - t_left) / (t[k] - t_left))
+            self.std.append(np.sqrt((t[l] - t_left) * (t[k] - t[l]) / (t[k] - t_left)))
+            j = k + 1
+            if j >= n:
+                j = 0
+
+    def increments(self, Z):
+
+        # Z: (paths x n) standard normals in order of importance -> (paths x n) standard normal increments
+        W = np.empty(Z.shape)
+        W[:, self.bridge[0]] = self.std[0] * Z[:, 0]
+        for i in range(1, Z.shape[1]):
+            j, k, l = self.left[i], self.right[i], self.bridge[i]
+            W[:, l] = self.right_weight[i] * W[:, k] + self.std[i] * Z[:, i]
+            if j > 0:
+                W[:, l] += self.left_weight[i] * W[:, j-1]
+        W[:, 1:] -= W[:, :-1].copy()
+        return W
+
+
+def _run_replication(payoffs, to_normals, dim, size, chunk_size, seed_seq, cancel=None):
+
+    # one independently scrambled Sobol sequence, simulated chunk by chunk
+    from scipy.stats import qmc
+    sobol = qmc.Sobol(d=dim, scramble=True, seed=np.random.default_rng(seed_seq))
+    acc = None
+    for start in range(0, size, chunk_size):
+        U = sobol.random(min(chunk_size, size - start))
+        X = payoffs(to_normals(np.clip(U, 1e-16, 1 - 1e-16)))
+        if acc is None:
+            acc = MomentAccumulator(X.shape[1])
+        acc.update(X)
+        _check(cancel)
+    return acc
+
+
+def run_qmc(payoffs, to_normals, dim, m, chunk_size, seed, replications, workers=1, progress=None, cancel=None):
+    """
+    Randomized quasi-Monte Carlo: independent scrambles of a Sobol sequence, one accumulator per replication.
+
+    Args:
+        payoffs: callable (normals) -> (size x k) array of per-path quantities
+        to_normals: callable (uniforms) -> normals in the layout expected by payoffs
+        dim: the dimension of the Sobol sequence
+        m: the total number of paths, rounded so that every replication simulates a power of 2 points
+        chunk_size: the number of paths simulated at once (None for all of them), rounded down to a power of 2
+        seed: the seed of the scrambles
+        replications: the number of independent scrambles
+        workers: the number of processes simulating replications in parallel
+        progress: a ProgressReporter called after every replication with the moments of the replications
+            done so far, None for no reporting
+        cancel: a threading.Event checked after every chunk (every replication with several workers),
+            SimulationCancelled is raised once it is set
+    """
+    _positive(m)
+    size = 2 ** max(int(round(np.log2(m / replications))), 0)
+    chunk = size if chunk_size is None else min(size, 2 ** int(np.log2(chunk_size)))
+    seeds = np.random.SeedSequence(seed).spawn(replications)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    # an event cannot be sent to the worker processes, they are only cancelled between replications
+    args = (repeat(payoffs), repeat(to_normals), repeat(dim), repeat(size), repeat(chunk), seeds,
+            repeat(None if executor else cancel))
+    accs, done = [], MomentAccumulator(0)
+    try:
+        for acc in (executor.map(_run_replication, *args) if executor else map(_run_replication, *args)):
+            accs.append(acc)
+            if progress is not None:
+                done = copy.deepcopy(acc) if done.count == 0 else done.merge(acc)
+                progress(done, final=len(accs) == replications)
+            _check(cancel)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return accs
+
+
+def replication_estimate(estimates):
+
+    # mean of the replication estimates with a Student t 95% confidence interval from their spread
+    from scipy.special import stdtrit
+    estimates = np.asarray(estimates, dtype=float)
+    R = len(estimates)
+    mean = np.mean(estimates)
+    stderr = np.std(estimates, ddof=1) / np.sqrt(R)
+    q = stdtrit(R - 1, 0.975)
+    return mean, stderr, (mean - q*stderr, mean + q*stderr)
+
+
+class MCResult:
+    """
+    The call and put prices estimated from one simulation, each with and without control variates.
+
+    Args:
+        paths: the number of paths simulated
+    """
+    def __init__(self, paths):
+
+        self.paths = paths
+        # (option_type, estimator) -> price, standard error, 95% confidence interval and control coefficients
+        self.estimates = {}
+
+    def add(self, option_type, estimator, price, stderr, conf, beta=None):
+
+        self.estimates[option_type, estimator] = {'price': float(price), 'stderr': float(stderr),
+                                                  'conf': (float(conf[0]), float(conf[1])), 'beta': beta}
+
+    def __getitem__(self, key):
+
+        # result[option_type, estimator], e.g. result['put', 'control_variate']
+        return self.estimates[key]
+
+    def price(self, option_type='call', ctrl_var=True):
+
+        return self.estimates[option_type, 'control_variate' if ctrl_var else 'plain']['price']
+
+    def __str__(self):
+
+        lines = ['{} paths'.format(self.paths)]
+        for (option_type, estimator), e in self.estimates.items():
+            lines.append('{:<4} {:<15} {:.6f} +/- {:.6f}, CI ({:.6f}, {:.6f}){}'.format(
+                option_type, estimator, e['price'], e['stderr'], e['conf'][0], e['conf'][1],
+                '' if e['beta'] is None else ', beta {}'.format(np.round(e['beta'], 6))))
+        return '\n'.join(lines)
+
+
+def plain_estimate(acc, i):
+
+    # standard Monte Carlo estimate of quantity i with its 95% confidence interval
+    mean = acc.mean[i]
+    std = np.sqrt(acc.cov()[i, i])
+    conf = (mean-1.96*std/np.sqrt(acc.count), mean+1.96*std/np.sqrt(acc.count))
+    return mean, std, conf
+
+
+def control_variate_estimate(acc, i, j, exact):
+
+    # control variate estimate of quantity i using the quantities j (an index or a list of indices), whose
+    # expectations are known exactly; with several controls the coefficients are the least-squares regression
+    j, exact = np.atleast_1d(j), np.atleast_1d(exact)
+    cov = acc.cov()
+    C, c = cov[np.ix_(j, j)], cov[j, i]
+    # a control without variance gets a zero coefficient
+    active = np.diag(C) > 0
+    theta = np.zeros(len(j))
+    if active.any():
+        theta[active] = np.linalg.lstsq(C[np.ix_(active, active)], c[active], rcond=None)[0]
+    mean = acc.mean[i] + theta @ (exact - acc.mean[j])
+    std = np.sqrt(max(cov[i, i] - 2*theta @ c + theta @ C @ theta, 0.0))
+    conf = (mean-1.96*std/np.sqrt(acc.count), mean+1.96*std/np.sqrt(acc.count))
+    return mean, std, conf, (theta[0] if theta.shape == (1,) else theta)
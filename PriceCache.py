@@ -0,0 +1,313 @@
+"""
+Opt-in bounded cache of closed-form prices.
+GeoAsianOption and CFGeoBasketOption are pure functions of their inputs, so a contract requested again (by another
+desk, within the same tick) is answered from a cache keyed on its inputs rounded to a number of significant digits.
+Entries are evicted least recently used beyond maxsize and expire after ttl seconds; hits, misses, evictions and
+expirations are counted for monitoring.
+A lookup costs a couple of microseconds, more than a Black-Scholes price (scalar or vectorized), so BSEuroOption
+has no cached form: the cache pays off for the Greeks and the baskets, see python PriceCache.py.
+"""
+from collections import OrderedDict
+from itertools import repeat
+import math
+import struct
+import threading
+import time
+import numpy as np
+from CFGeoAsianOption import GeoAsianOption
+from CFGeoBasketOption import CFGeoBasketOption
+
+_MISSING = object()
+
+
+def _mantissa_mask(digits):
+
+    # the half unit and the mask rounding the 52-bit mantissa of a double to about digits significant digits
+    drop = 52 - min(52, math.ceil(digits * math.log2(10)))
+    return (1 << drop >> 1), ~((1 << drop) - 1) & 0xFFFFFFFFFFFFFFFF
+
+
+def _round_bits(x, half, mask):
+
+    # the bit patterns of the doubles of x (an array) with the binary mantissa rounded, with integer operations
+    # far cheaper than rounding in decimal; they are the normalized form of the numeric inputs in the keys
+    bits = np.ascontiguousarray(x, dtype=float).view(np.uint64)
+    return (bits + np.uint64(half)) & np.uint64(mask)
+
+
+def round_significant(x, digits=12):
+
+    # x (an array) rounded to about digits significant digits
+    return _round_bits(x, *_mantissa_mask(digits)).view(float)
+
+
+# count -> the structs packing that many doubles and unpacking them as integers, for the scalar keys
+_STRUCTS = {}
+
+
+def _packers(count):
+
+    packers = _STRUCTS.get(count)
+    if packers is None:
+        packers = _STRUCTS[count] = struct.Struct('<{}d'.format(count)), struct.Struct('<{}Q'.format(count))
+    return packers
+
+
+def _copy(greeks):
+
+    # a copy of a cached dict of Greeks, so that the caller cannot alter the cached one (nor its arrays)
+    return {name: np.array(value) if isinstance(value, np.ndarray) else value for name, value in greeks.items()}
+
+
+class PriceCache:
+    """
+    Args:
+        maxsize: the maximal number of entries, the least recently used one is evicted beyond it
+        ttl: the seconds an entry stays valid (None for no expiry)
+        digits: the significant digits the numeric inputs are rounded to in the keys
+        clock: callable returning the current time in seconds
+    """
+    def __init__(self, maxsize=100000, ttl=None, digits=12, clock=time.monotonic):
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.digits = digits
+        self._half, self._mask = _mantissa_mask(digits)
+        self.clock = clock
+        # key -> (value, expiry time), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, name, *inputs):
+
+        # the key of one contract: the name of the pricer (and of the option type) and the bit patterns of its
+        # numeric inputs rounded, all packed at once; the same integers as those of keys()
+        half, mask = self._half, self._mask
+        pack, unpack = _packers(len(inputs))
+        return (name,) + tuple((bits + half) & mask for bits in unpack.unpack(pack.pack(*inputs)))
+
+    def keys(self, name, columns):
+
+        # the keys of a batch of contracts, one array of inputs per column: numbers are keyed as in key(), which
+        # also makes a missing input (NaN) equal to itself, strings and tuples as they are
+        columns = [column.tolist() if np.asarray(column).dtype.kind in 'UO'
+                   else _round_bits(column, self._half, self._mask).tolist() for column in columns]
+        return list(zip(repeat(name), *columns))
+
+    def _lookup(self, key, now):
+
+        # the value of key, _MISSING when absent or expired; called with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            self.expirations += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _store(self, key, value, now):
+
+        self._entries[key] = (value, None if self.ttl is None else now + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, compute):
+
+        # the value of key, computed by compute() and stored on a miss
+        with self._lock:
+            value = self._lookup(key, self.clock())
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._store(key, value, self.clock())
+        return value
+
+    def lookup_many(self, keys):
+        """
+        Args:
+            keys: list of keys, one per contract
+        Returns:
+            the list of the cached values, None for the contracts missing from the cache, and the dict of the keys
+            missed -> the index of their first contract, a contract repeated within the batch being missed once
+        """
+        with self._lock:
+            now = self.clock()
+            found = [self._lookup(key, now) for key in keys]
+        missed = {}
+        for i, (key, value) in enumerate(zip(keys, found)):
+            if value is _MISSING:
+                missed.setdefault(key, i)
+        with self._lock:
+            self.misses += len(missed)
+            self.hits += len(keys) - len(missed)
+        return [None if value is _MISSING else value for value in found], missed
+
+    def store_many(self, values):
+
+        # stores the dict of keys -> values priced after a lookup_many
+        with self._lock:
+            now = self.clock()
+            for key, value in values.items():
+                self._store(key, value, now)
+
+    def get_many(self, keys, compute):
+        """
+        The hits are read from the cache and all the misses priced in one batch, a contract repeated within
+        the batch being priced once.
+
+        Args:
+            keys: list of keys, one per contract
+            compute: callable (index array of the contracts missed) -> array of their values, one row per contract
+        Returns:
+            array of the values of all the contracts, in the order of keys
+        """
+        found, missed = self.lookup_many(keys)
+        computed = {}
+        if missed:
+            values = np.asarray(compute(np.fromiter(missed.values(), dtype=int, count=len(missed)))).tolist()
+            computed = dict(zip(missed, values))
+            self.store_many(computed)
+        return np.array([computed[key] if value is None else value for key, value in zip(keys, found)])
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+
+        # the counters, for monitoring
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class CachedGeoAsianOption(GeoAsianOption):
+    """
+    GeoAsianOption answering the contracts already priced from a cache.
+
+    Args:
+        cache: the PriceCache
+        S, sigma, r, T, K, n: the contract, as for GeoAsianOption
+    """
+    def __init__(self, cache, S, sigma, r, T, K, n):
+
+        GeoAsianOption.__init__(self, S, sigma, r, T, K, n)
+        self.cache = cache
+
+    def _key(self, name):
+
+        return self.cache.key(name, self.S, self.sigma, self.r, self.T, self.K, self.n)
+
+    def CallGeoAsian(self):
+
+        return self.cache.get(self._key('geo_asian_call'), lambda: GeoAsianOption.CallGeoAsian(self))
+
+    def PutGeoAsian(self):
+
+        return self.cache.get(self._key('geo_asian_put'), lambda: GeoAsianOption.PutGeoAsian(self))
+
+    def GreeksGeoAsian(self, option='call'):
+
+        return _copy(self.cache.get(self._key('geo_asian_greeks_' + option),
+                                   lambda: GeoAsianOption.GreeksGeoAsian(self, option)))
+
+
+class CachedGeoBasketOption(CFGeoBasketOption):
+    """
+    CFGeoBasketOption answering the contracts already priced from a cache.
+
+    Args:
+        cache: the PriceCache
+        **contract: the contract, as for CFGeoBasketOption (two assets or N assets)
+    """
+    def __init__(self, cache, **contract):
+
+        CFGeoBasketOption.__init__(self, **contract)
+        self.cache = cache
+
+    def _key(self, name, *inputs):
+
+        # the two-asset and the N-asset forms of the same basket share their key; the assets enter it as the bytes
+        # of their rounded arrays, so a large correlation matrix costs one vectorized rounding
+        s0, sigma, corr, weights = self.Assets()
+        assets = round_significant(np.concatenate([[len(s0)], s0, sigma, corr.ravel(), weights]), self.cache.digits)
+        return self.cache.key(name, *inputs, self.r, self.T, self.K, self.n) + (assets.tobytes(),)
+
+    def CallGeoBasket(self, t=0):
+
+        return self.cache.get(self._key('geo_basket_call', t), lambda: CFGeoBasketOption.CallGeoBasket(self, t))
+
+    def PutGeoBasket(self, t=0):
+
+        return self.cache.get(self._key('geo_basket_put', t), lambda: CFGeoBasketOption.PutGeoBasket(self, t))
+
+    def GreeksGeoBasket(self, option='call'):
+
+        return _copy(self.cache.get(self._key('geo_basket_greeks_' + option),
+                                   lambda: CFGeoBasketOption.GreeksGeoBasket(self, option)))
+
+
+if __name__ == '__main__':
+    # quote streams repeating 200 distinct contracts: the cache pays off where the pricing costs more than the
+    # lookup (the Greeks, large baskets), while the vectorized plain closed form is about as cheap as the lookup
+    from BSEuroOption import BSEuroOption
+    rng = np.random.default_rng(0)
+    cache = PriceCache(maxsize=10000)
+    strikes = rng.uniform(80, 120, 200)
+    requests = rng.integers(0, 200, 20000)
+    N = 20
+    A = rng.standard_normal((N, N))
+    corr = A @ A.T / np.sqrt(np.outer(np.diag(A @ A.T), np.diag(A @ A.T)))
+
+    def asian(pricer, K):
+        return pricer(100, 0.3, 0.05, 3, K, 50).GreeksGeoAsian('call')
+
+    def basket(pricer, K):
+        return pricer(s0=np.full(N, 100.0), sigma=np.full(N, 0.3), corr=corr, r=0.05, T=1, K=K, n=12).GreeksGeoBasket()
+
+    for name, uncached, cached in [
+            ('BSEuroOption.CallOption (the key alone)', lambda K: BSEuroOption().CallOption(100, 0.3, 0.05, 0, 1, K),
+             lambda K: cache.key('bs_call', 100, 0.3, 0.05, 0, 1, K)),
+            ('GeoAsianOption.GreeksGeoAsian', lambda K: asian(GeoAsianOption, K),
+             lambda K: asian(lambda *contract: CachedGeoAsianOption(cache, *contract), K)),
+            ('CFGeoBasketOption.GreeksGeoBasket ({} assets)'.format(N), lambda K: basket(CFGeoBasketOption, K),
+             lambda K: basket(lambda **contract: CachedGeoBasketOption(cache, **contract), K))]:
+        timings = []
+        for pricer in (uncached, cached):
+            start = time.perf_counter()
+            for k in requests:
+                pricer(strikes[k])
+            timings.append((time.perf_counter() - start) / len(requests) * 1e6)
+        print('{:<44} {:8.2f} us uncached, {:8.2f} us cached'.format(name, *timings))
+
+    # the vectorized path: hits looked up and the misses priced in one batch
+    start = time.perf_counter()
+    for batch in np.split(requests, 20):
+        GeoAsianOption.BatchGeoAsian(100, 0.3, 0.05, 3, strikes[batch], 50)
+    uncached = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch in np.split(requests, 20):
+        values = cache.get_many(cache.keys('geo_asian_call', [strikes[batch]]),
+                                lambda miss: GeoAsianOption.BatchGeoAsian(100, 0.3, 0.05, 3, strikes[batch][miss], 50))
+    print('{:<44} {:8.2f} us uncached, {:8.2f} us cached'.format(
+        'GeoAsianOption.BatchGeoAsian (batches)', uncached / len(requests) * 1e6,
+        (time.perf_counter() - start) / len(requests) * 1e6))
+    print(cache.stats())
+
+    # the cached prices are those of the pricers
+    exact = GeoAsianOption.BatchGeoAsian(100, 0.3, 0.05, 3, strikes[batch], 50)
+    print('max difference', np.max(np.abs(values - exact)))
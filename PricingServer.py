@@ -0,0 +1,344 @@
+"""
+Local pricing service: an asyncio HTTP front end over the batch engines of BatchPricer.
+Requests for the same product arriving within a short window are coalesced into one vectorized batch call.
+Closed forms and implied volatilities are priced on the event loop; lattice batches and Monte Carlo jobs go to
+a process pool, so cheap requests never queue behind them.
+
+POST /price with a JSON object (one trade, the columns of BatchPricer) or a JSON list of them;
+the response holds value, conf_low and conf_high for every trade (null where the trade could not be priced);
+in a list, a trade that is not a JSON object or names an unknown product answers {"error": ...} in its place.
+A coalesced batch that raises is priced again trade by trade, so a malformed trade fails only its own request.
+GET /stats returns the request and batch counts and the counters of the price cache, if any.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import math
+import time
+import numpy as np
+from BatchPricer import CACHED, PRODUCTS, RESULT_COLUMNS, cache_keys, price_chunk
+
+logger = logging.getLogger(__name__)
+
+# products priced in the process pool; the lattice still benefits from coalescing, Monte Carlo jobs do not
+POOLED = {'american', 'arith_asian', 'arith_basket'}
+COALESCED = set(PRODUCTS) - {'arith_asian', 'arith_basket'}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+
+
+def _result(values):
+
+    return {name: (None if math.isnan(value) else value) for name, value in zip(RESULT_COLUMNS, values)}
+
+
+class PricingServer:
+    """
+    Args:
+        host: the interface to listen on
+        port: the port to listen on, 0 for any free port
+        window: the seconds a request waits for others of the same product before its batch is priced
+        max_batch: the largest batch, priced as soon as it is full
+        workers: the number of processes pricing the lattice and Monte Carlo jobs (None for one per CPU)
+        cache: a PriceCache.PriceCache answering the contracts of BatchPricer.CACHED already priced, None for no cache
+    """
+    def __init__(self, host='127.0.0.1', port=0, window=0.002, max_batch=1024, workers=None, cache=None):
+
+        self.host = host
+        self.port = port
+        self.window = window
+        self.max_batch = max_batch
+        self.workers = workers
+        self.cache = cache
+        # product -> list of (trade, future) waiting for their batch
+        self._pending = {}
+        # the open connections, closed with the server
+        self._connections = {}
+        self.batches = 0
+        self.requests = 0
+
+    async def start(self):
+
+        self._loop = asyncio.get_running_loop()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('pricing server listening on %s:%d', self.host, self.port)
+
+    async def close(self):
+
+        self._server.close()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._pool.shutdown()
+
+    async def price(self, trade):
+
+        # price one trade, coalesced with the concurrent requests for the same product
+        self.requests += 1
+        if not isinstance(trade, dict):
+            raise ValueError('a trade is a JSON object, got {!r}'.format(trade))
+        product = str(trade.get('product', '')).strip().lower()
+        if product not in PRODUCTS:
+            raise ValueError('unknown product {!r}'.format(product))
+        if product not in COALESCED:
+            self.batches += 1
+            values = await self._pooled(product, [trade])
+            return _result(values[0])
+
+        future = self._loop.create_future()
+        batch = self._pending.setdefault(product, [])
+        batch.append((trade, future))
+        if len(batch) == 1:
+            self._loop.call_later(self.window, self._flush, product, batch)
+        if len(batch) >= self.max_batch:
+            self._flush(product, batch)
+        return _result(await future)
+
+    def _flush(self, product, batch):
+
+        # the timer of a batch already priced when full finds it gone
+        if self._pending.get(product) is not batch:
+            return
+        del self._pending[product]
+        self.batches += 1
+        trades = [trade for trade, _ in batch]
+        if product in POOLED:
+            job = asyncio.ensure_future(self._pooled(product, trades))
+            job.add_done_callback(lambda job: self._done(product, batch, job))
+        else:
+            try:
+                self._deliver(batch, price_chunk(trades, cache=self.cache))
+            except Exception as error:
+                self._failed(product, batch, error)
+
+    def _done(self, product, batch, job):
+
+        # the end of a pooled batch; a cancelled job has no exception() to read, it raises CancelledError
+        if job.cancelled():
+            self._deliver(batch, asyncio.CancelledError())
+        elif job.exception() is not None:
+            self._failed(product, batch, job.exception())
+        else:
+            self._deliver(batch, job.result())
+
+    def _failed(self, product, batch, error):
+
+        # a batch that raised is priced again trade by trade, so that a malformed trade fails only its own request
+        if len(batch) == 1:
+            self._deliver(batch, error)
+            return
+        logger.warning('batch of %d %s trades failed (%r), pricing them one by one', len(batch), product, error)
+        for trade, future in batch:
+            if product in POOLED:
+                job = asyncio.ensure_future(self._pooled(product, [trade]))
+                job.add_done_callback(lambda job, single=[(trade, future)]: self._done(product, single, job))
+            else:
+                try:
+                    self._deliver([(trade, future)], price_chunk([trade], cache=self.cache))
+                except Exception as error:
+                    self._deliver([(trade, future)], error)
+
+    async def _pooled(self, product, trades):
+
+        # trades priced in the process pool; with a cache, its hits are answered here and only the misses sent
+        if self.cache is None or product not in CACHED:
+            return await self._loop.run_in_executor(self._pool, price_chunk, trades)
+        keys = cache_keys(self.cache, product, trades)
+        found, missed = self.cache.lookup_many(keys)
+        computed = {}
+        if missed:
+            values = await self._loop.run_in_executor(self._pool, price_chunk, [trades[i] for i in missed.values()])
+            computed = dict(zip(missed, values.tolist()))
+            self.cache.store_many(computed)
+        return np.array([computed[key] if value is None else value for key, value in zip(keys, found)])
+
+    def _deliver(self, batch, values):
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if isinstance(values, BaseException):
+                future.set_exception(values)
+            else:
+                future.set_result(values[i])
+
+    async def _handle(self, reader, writer):
+
+        # minimal HTTP/1.1 with keep-alive: POST /price, JSON in and out
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method, path, _ = request.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'GET' and path == '/stats':
+                    status, response = 200, {'requests': self.requests, 'batches': self.batches,
+                                             'cache': None if self.cache is None else self.cache.stats()}
+                elif method != 'POST' or path != '/price':
+                    status, response = 404, {'error': 'POST /price or GET /stats'}
+                else:
+                    try:
+                        trades = json.loads(body)
+                        if isinstance(trades, list):
+                            # a trade that cannot be priced answers its own error, the others are still priced
+                            results = await asyncio.gather(*(self.price(trade) for trade in trades),
+                                                           return_exceptions=True)
+                            response = [{'error': str(result)} if isinstance(result, BaseException) else result
+                                        for result in results]
+                        else:
+                            response = await self.price(trades)
+                        status = 200
+                    except Exception as error:
+                        status, response = 400, {'error': str(error)}
+
+                payload = json.dumps(response).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+                    status, REASONS[status], len(payload)).encode() + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+
+async def request(reader, writer, trade, host='127.0.0.1'):
+
+    # one POST /price on an open keep-alive connection
+    body = json.dumps(trade).encode()
+    writer.write('POST /price HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+        host, len(body)).encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def benchmark(trades, clients=64, requests_per_client=200, **server_args):
+    """
+    Load generation on localhost: clients keep-alive connections sending requests_per_client trades each.
+
+    Args:
+        trades: callable (client, i) -> the i-th trade sent by a client
+    Returns:
+        latencies (seconds) of the requests by product, the wall time and the number of batches priced
+    """
+    server = PricingServer(**server_args)
+    await server.start()
+    latencies = {}
+
+    async def client(c):
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        for i in range(requests_per_client):
+            trade = trades(c, i)
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, trade)
+            latencies.setdefault(trade['product'], []).append(time.perf_counter() - start)
+            assert status == 200
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    wall = time.perf_counter() - start
+    await server.close()
+    return latencies, wall, server.batches
+
+
+def _report(name, latencies, wall, batches):
+
+    every = np.concatenate([np.asarray(value) for value in latencies.values()])
+    print('{}: {} requests in {:.2f}s ({:.0f} req/s), {} batches, p50 {:.2f} ms, p99 {:.2f} ms'.format(
+        name, len(every), wall, len(every) / wall, batches,
+        np.percentile(every, 50) * 1e3, np.percentile(every, 99) * 1e3))
+    for product, value in sorted(latencies.items()):
+        print('    {:<12} p50 {:8.2f} ms, p99 {:8.2f} ms'.format(
+            product, np.percentile(value, 50) * 1e3, np.percentile(value, 99) * 1e3))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Local pricing service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--window', type=float, default=0.002, help='seconds requests wait to be coalesced')
+    parser.add_argument('--workers', type=int, default=None, help='processes for the lattice and Monte Carlo jobs')
+    parser.add_argument('--cache-size', type=int, default=0, help='prices kept, 0 for no cache')
+    parser.add_argument('--cache-ttl', type=float, default=None, help='seconds a cached price stays valid')
+    parser.add_argument('--benchmark', action='store_true', help='run the load benchmark on localhost and exit')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO)
+
+    def cache():
+        from PriceCache import PriceCache
+        return PriceCache(maxsize=args.cache_size or 100000, ttl=args.cache_ttl)
+
+    if not args.benchmark:
+        async def serve():
+            server = PricingServer(args.host, args.port, args.window, workers=args.workers,
+                                   cache=cache() if args.cache_size > 0 else None)
+            await server.start()
+            await server._server.serve_forever()
+        asyncio.run(serve())
+        return
+
+    rng = np.random.default_rng(0)
+
+    def european(c, i):
+        return {'product': 'european', 'S': 100, 'sigma': float(rng.uniform(0.1, 0.5)), 'r': 0.05, 'q': 0,
+                'T': float(rng.uniform(0.1, 2)), 'K': float(rng.uniform(80, 120)), 'option_type': 'call'}
+
+    def mixed(c, i):
+        # one client in eight asks for Monte Carlo and lattice prices, the others for closed forms
+        if c % 8 == 0:
+            if i % 2:
+                return {'product': 'arith_asian', 'S': 100, 'sigma': 0.3, 'r': 0.05, 'T': 1, 'K': 100, 'n': 50,
+                        'm': 20000, 'option_type': 'call', 'ctrl_var': True}
+            return {'product': 'american', 'S': 100, 'sigma': 0.3, 'r': 0.05, 'T': 1, 'K': 100, 'N': 500,
+                    'option_type': 'put'}
+        return european(c, i)
+
+    def quotes(c, i):
+        # the desks keep asking for the same 160 American contracts
+        return {'product': 'american', 'S': 100, 'sigma': 0.3, 'r': 0.05, 'T': [0.25, 0.5, 1, 2][i % 4],
+                'K': 80 + (c + i) % 40, 'N': 200, 'option_type': 'put'}
+
+    for name, trades, count, max_batch, price_cache in [
+            ('closed forms, no coalescing', european, 200, 1, None),
+            ('closed forms, coalesced', european, 200, 1024, None),
+            ('mixed book, coalesced', mixed, 40, 1024, None),
+            ('repeated quotes, coalesced', quotes, 200, 1024, None),
+            ('repeated quotes, coalesced and cached', quotes, 200, 1024, cache())]:
+        _report(name, *asyncio.run(benchmark(trades, requests_per_client=count, window=args.window,
+                                             max_batch=max_batch, workers=args.workers, cache=price_cache)))
+        if price_cache is not None:
+            print('    cache', price_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
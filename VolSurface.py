@@ -0,0 +1,116 @@
+"""
+Implied volatility surface built from an option chain of a single underlying.
+The implied volatilities are solved in one batch and stored on an (expiry x strike) grid,
+queries are answered by interpolating the grid in strike and in total variance along expiry.
+"""
+import numpy as np
+from ImpliedVolatility import BatchImpliedVolatility
+
+
+def _locate(x, nodes):
+
+    # lower/upper node index and linear weight of each x, flat beyond the first and last node
+    x = np.clip(x, nodes[0], nodes[-1])
+    if len(nodes) == 1:
+        lo = np.zeros(x.shape, dtype=int)
+        return lo, lo, np.zeros(x.shape)
+    lo = np.clip(np.searchsorted(nodes, x, side='right') - 1, 0, len(nodes) - 2)
+    weight = (x - nodes[lo]) / (nodes[lo + 1] - nodes[lo])
+    return lo, lo + 1, weight
+
+
+class VolSurface:
+    """
+    Args:
+        S: Spot Price of the underlying
+        r: Risk-free Interest Rate
+        q: Repo Rate
+        T: Times to Maturity (in years) of the quotes
+        K: Strikes of the quotes
+        V: Option Premiums of the quotes
+        option_type: 'call' or 'put' for every quote
+        method: the implied volatility solver, 'bracketed' or 'newton'
+    """
+    def __init__(self, S, r, q, T, K, V, option_type, method='bracketed'):
+
+        self.S = S
+        self.r = r
+        self.q = q
+        self.method = method
+        self.expiries = np.empty(0)
+        self.strikes = np.empty(0)
+        # implied volatilities of the quotes, NaN where no quote has been solved
+        self.grid = np.empty((0, 0))
+        # total variance sigma^2*T with the holes filled along the strikes, rebuilt lazily for dirty expiries
+        self._variance = np.empty((0, 0))
+        self._dirty = np.empty(0, dtype=bool)
+        self._cache = {}
+        self.update(T, K, V, option_type)
+
+    def update(self, T, K, V, option_type):
+
+        # re-solve only the quotes given, the last quote for a grid cell wins
+        T, K, V, option_type = (np.ravel(x) for x in np.broadcast_arrays(T, K, V, option_type))
+        self._extend(T, K)
+
+        sigma = BatchImpliedVolatility(self.S, self.r, self.q, T, K, V, option_type).Volatility(method=self.method)
+        rows = np.searchsorted(self.expiries, T)
+        cols = np.searchsorted(self.strikes, K)
+        self.grid[rows, cols] = sigma
+        self._dirty[rows] = True
+        self._cache.clear()
+
+    def _extend(self, T, K):
+
+        # grow the grid when the quotes bring new expiries or strikes
+        expiries = np.union1d(self.expiries, T)
+        strikes = np.union1d(self.strikes, K)
+        if len(expiries) == len(self.expiries) and len(strikes) == len(self.strikes):
+            return
+
+        grid = np.full((len(expiries), len(strikes)), np.nan)
+        rows = np.searchsorted(expiries, self.expiries)
+        cols = np.searchsorted(strikes, self.strikes)
+        grid[np.ix_(rows, cols)] = self.grid
+
+        self.expiries, self.strikes, self.grid = expiries, strikes, grid
+        self._variance = np.full(grid.shape, np.nan)
+        self._dirty = np.ones(len(expiries), dtype=bool)
+
+    def _filled_variance(self):
+
+        for i in np.flatnonzero(self._dirty):
+            row = self.grid[i]
+            valid = np.isfinite(row)
+            if valid.any():
+                # fill the holes of an expiry by linear interpolation in strike, flat beyond its quotes
+                row = np.interp(self.strikes, self.strikes[valid], row[valid])
+            self._variance[i] = row**2 * self.expiries[i]
+        self._dirty[:] = False
+        return self._variance
+
+    def sigma(self, T, K):
+
+        # implied volatility for maturities T and strikes K (scalars or arrays, broadcast against each other)
+        if np.isscalar(T) and np.isscalar(K):
+            key = (T, K)
+            if key not in self._cache:
+                self._cache[key] = float(self._interpolate(np.asarray(T, dtype=float), np.asarray(K, dtype=float)))
+            return self._cache[key]
+
+        T, K = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(K, dtype=float))
+        return self._interpolate(T, K)
+
+    def _interpolate(self, T, K):
+
+        w = self._filled_variance()
+        i0, i1, a = _locate(T, self.expiries)
+        j0, j1, b = _locate(K, self.strikes)
+
+        # linear in strike on the two neighbouring expiries
+        w0 = (1 - b) * w[i0, j0] + b * w[i0, j1]
+        w1 = (1 - b) * w[i1, j0] + b * w[i1, j1]
+        # linear in total variance between the expiries, flat volatility beyond the first and last
+        Tc = np.clip(T, self.expiries[0], self.expiries[-1])
+        variance = ((1 - a) * w0 + a * w1) / Tc
+        return np.sqrt(variance)
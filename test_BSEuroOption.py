@@ -0,0 +1,73 @@
+"""
+Tests of the Black-Scholes formulas and their Greeks: python -m pytest test_BSEuroOption.py
+"""
+import numpy as np
+import pytest
+from BSEuroOption import BSEuroOption, OptionSign
+from CFGeoAsianOption import GeoAsianOption
+from CFGeoBasketOption import CFGeoBasketOption
+
+CONTRACT = dict(S=100.0, sigma=0.3, r=0.05, q=0.02, T=1.5, K=95.0)
+
+
+def _bumped(price, inputs, name, h):
+
+    # central difference of price in the input name
+    up, down = dict(inputs), dict(inputs)
+    up[name] += h
+    down[name] -= h
+    return (price(**up) - price(**down)) / (2*h)
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_greeks_match_bump_and_reprice(option):
+
+    bs = BSEuroOption()
+    price = lambda **inputs: bs.Greeks(option=option, **inputs)['price']
+    greeks = bs.Greeks(option=option, **CONTRACT)
+    np.testing.assert_allclose(greeks['price'], (bs.CallOption if option == 'call' else bs.PutOption)(**CONTRACT))
+    for name, input in [('delta', 'S'), ('vega', 'sigma'), ('rho', 'r')]:
+        np.testing.assert_allclose(greeks[name], _bumped(price, CONTRACT, input, 1e-5), rtol=1e-6)
+    np.testing.assert_allclose(greeks['theta'], -_bumped(price, CONTRACT, 'T', 1e-5), rtol=1e-6)
+    delta = lambda **inputs: bs.Greeks(option=option, **inputs)['delta']
+    np.testing.assert_allclose(greeks['gamma'], _bumped(delta, CONTRACT, 'S', 1e-4), rtol=1e-6)
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_geometric_asian_greeks_match_bump_and_reprice(option):
+
+    inputs = dict(S=100.0, sigma=0.3, r=0.05, T=2.0, K=100.0, n=50)
+    price = lambda **inputs: GeoAsianOption(**inputs).GreeksGeoAsian(option)['price']
+    greeks = GeoAsianOption(**inputs).GreeksGeoAsian(option)
+    for name, input in [('delta', 'S'), ('vega', 'sigma'), ('rho', 'r')]:
+        np.testing.assert_allclose(greeks[name], _bumped(price, inputs, input, 1e-5), rtol=1e-6)
+    np.testing.assert_allclose(greeks['theta'], -_bumped(price, inputs, 'T', 1e-5), rtol=1e-6)
+
+
+def test_geometric_basket_greeks_match_bump_and_reprice():
+
+    corr = np.array([[1, 0.5, 0.2], [0.5, 1, 0.3], [0.2, 0.3, 1]])
+    s0, sigma, weights = np.array([100, 95, 90.]), np.array([0.3, 0.25, 0.2]), np.array([0.5, 0.3, 0.2])
+    basket = lambda s0=s0, sigma=sigma, r=0.05: CFGeoBasketOption(r=r, T=1, K=95, s0=s0, sigma=sigma, corr=corr,
+                                                                  weights=weights, n=12).GreeksGeoBasket('put')
+    greeks = basket()
+    for i in range(3):
+        bump = np.eye(3)[i]*1e-5
+        np.testing.assert_allclose(greeks['delta'][i], (basket(s0=s0+bump)['price'] - basket(s0=s0-bump)['price'])/2e-5,
+                                   rtol=1e-6)
+        np.testing.assert_allclose(greeks['vega'][i],
+                                   (basket(sigma=sigma+bump)['price'] - basket(sigma=sigma-bump)['price'])/2e-5,
+                                   rtol=1e-6)
+        np.testing.assert_allclose(greeks['gamma'][i],
+                                   (basket(s0=s0+bump*10)['delta'][i] - basket(s0=s0-bump*10)['delta'][i])/2e-4,
+                                   rtol=1e-5)
+    np.testing.assert_allclose(greeks['rho'], (basket(r=0.05+1e-5)['price'] - basket(r=0.05-1e-5)['price'])/2e-5,
+                               rtol=1e-6)
+
+
+def test_misspelled_option_types_are_rejected():
+
+    np.testing.assert_array_equal(OptionSign(['call', 'put']), [1, -1])
+    for option in ['Call', 'cal', 1, ['call', 'putt']]:
+        with pytest.raises(ValueError, match="'call' or 'put'"):
+            BSEuroOption().Greeks(option=option, **CONTRACT)
@@ -0,0 +1,64 @@
+"""
+Regression tests of the batch driver: python -m pytest test_BatchPricer.py
+"""
+import numpy as np
+from BatchPricer import price_chunk
+
+GOOD = [{'product': 'european', 'S': '100', 'sigma': '0.3', 'r': '0.05', 'T': '1', 'K': '100'},
+        {'product': 'geo_asian', 'S': '100', 'sigma': '0.3', 'r': '0.05', 'T': '1', 'K': '100', 'n': '50'},
+        {'product': 'geo_basket', 's0_1': '100', 's0_2': '95', 'sigma_1': '0.3', 'sigma_2': '0.25', 'r': '0.05',
+         'T': '1', 'K': '100', 'rho': '0.5', 'option_type': 'put'},
+        {'product': 'geo_basket', 's0': '100;95;90', 'sigma': '0.3;0.25;0.2', 'corr': '0.4', 'weights': '0.5;0.3;0.2',
+         'r': '0.05', 'T': '1', 'K': '95', 'n': '12'},
+        {'product': 'american', 'S': '100', 'sigma': '0.3', 'r': '0.05', 'T': '1', 'K': '100', 'N': '100.0',
+         'option_type': 'put'},
+        {'product': 'implied_vol', 'S': '100', 'r': '0.05', 'T': '1', 'K': '100', 'V': '14'},
+        {'product': 'arith_asian', 'S': '100', 'sigma': '0.3', 'r': '0.05', 'T': '1', 'K': '100', 'n': '10',
+         'm': '2000'}]
+
+BAD = [dict(GOOD[0], S='abc'),
+       dict(GOOD[1], n=''),
+       dict(GOOD[2], rho=None),
+       dict(GOOD[3], corr='0.4;0.1'),
+       dict(GOOD[4], N='1', method='bbsr'),
+       dict(GOOD[4], N='many'),
+       dict(GOOD[5], V='x'),
+       dict(GOOD[6], S=''),
+       dict(GOOD[6], m='0'),
+       dict(GOOD[6], m='-5'),
+       dict(GOOD[6], option_type=1),
+       dict(GOOD[2], product='arith_basket', m='0'),
+       dict(GOOD[0], option_type=1),
+       dict(GOOD[1], option_type='cal'),
+       dict(GOOD[4], N='1e12'),
+       {'product': 'swaption'}]
+
+
+def test_bad_rows_give_nan_without_failing_the_chunk():
+
+    alone = price_chunk(GOOD)
+    mixed = price_chunk(GOOD + BAD)
+    assert np.all(np.isfinite(alone))
+    np.testing.assert_array_equal(mixed[:len(GOOD)], alone)
+    assert np.all(np.isnan(mixed[len(GOOD):]))
+
+
+def test_basket_of_n_assets_matches_the_pricer():
+
+    from CFGeoBasketOption import CFGeoBasketOption
+    corr = np.full((3, 3), 0.4)
+    np.fill_diagonal(corr, 1.0)
+    option = CFGeoBasketOption(r=0.05, T=1, K=95, option_type='call', s0=np.array([100, 95, 90.]),
+                               sigma=np.array([0.3, 0.25, 0.2]), corr=corr, weights=np.array([0.5, 0.3, 0.2]), n=12)
+    np.testing.assert_allclose(price_chunk([GOOD[3]])[0], option.CallGeoBasket(), rtol=1e-12)
+
+
+def test_cached_chunks_match_uncached():
+
+    from PriceCache import PriceCache
+    cache = PriceCache()
+    rows = GOOD + BAD + GOOD
+    uncached = price_chunk(rows)
+    np.testing.assert_array_equal(price_chunk(rows, cache=cache), uncached)
+    np.testing.assert_array_equal(price_chunk(rows, cache=cache), uncached)
+    assert cache.hits > 0
@@ -0,0 +1,88 @@
+"""
+Tests of the binomial lattices for American options: python -m pytest test_BiTreeAmericanOption.py
+"""
+import threading
+import numpy as np
+import pytest
+from BSEuroOption import BSEuroOption
+from BiTreeAmericanOption import BiTreeAmericanOption, MaxSteps
+
+CONTRACT = dict(S0=100.0, sigma=0.3, r=0.05, T=1.0, K=100.0)
+
+
+def _price(**inputs):
+
+    return BiTreeAmericanOption().BiTreeAmericanOption(**dict(CONTRACT, N=2000, option='put', method='bbsr', **inputs))
+
+
+def test_greeks_match_bump_and_reprice():
+
+    # on the smoothed lattice, whose price is smooth in the inputs (the plain one oscillates with S0)
+    greeks = BiTreeAmericanOption().BiTreeAmericanGreeks(**CONTRACT, N=2000, option='put', method='bbsr')
+    np.testing.assert_allclose(greeks['price'], _price(), rtol=1e-12)
+    np.testing.assert_allclose(greeks['delta'], (_price(S0=101) - _price(S0=99))/2, rtol=1e-3)
+    np.testing.assert_allclose(greeks['gamma'], _price(S0=101) - 2*_price() + _price(S0=99), rtol=1e-2)
+    np.testing.assert_allclose(greeks['theta'], -(_price(T=1.001) - _price(T=0.999))/0.002, rtol=1e-3)
+
+
+def test_steps_out_of_range_are_rejected():
+
+    lattice = BiTreeAmericanOption()
+    for N, method, greeks in [(0, 'crr', False), (1, 'bbsr', False), (2, 'crr', True), (5, 'bbsr', True),
+                              (MaxSteps + 1, 'crr', False)]:
+        with pytest.raises(ValueError, match='steps'):
+            if greeks:
+                lattice.BiTreeAmericanGreeks(**CONTRACT, N=N, option='put', method=method)
+            else:
+                lattice.BiTreeAmericanOption(**CONTRACT, N=N, option='put', method=method)
+
+
+def test_misspelled_option_types_are_rejected():
+
+    lattice = BiTreeAmericanOption()
+    with pytest.raises(ValueError, match="'call' or 'put'"):
+        lattice.BiTreeAmericanOption(**CONTRACT, N=100, option='Put')
+    with pytest.raises(ValueError, match="'call' or 'put'"):
+        lattice.BatchBiTreeAmericanOption(**CONTRACT, N=100, option=np.array(['call', 'cal']))
+    with pytest.raises(ValueError, match="'call' or 'put'"):
+        lattice.BiTreeAmericanGreeks(**CONTRACT, N=100, option='puts')
+
+
+@pytest.mark.parametrize('method, N, error', [('crr', 201, 2e-2), ('bbs', 201, 5e-3), ('bbsr', 201, 5e-4),
+                                              ('lr', 201, 2e-5), ('lr', 1001, 1e-6)])
+def test_lattices_converge_to_black_scholes_without_early_exercise(method, N, error):
+
+    # without dividends an American call is never exercised early, so it is worth the European one
+    exact = BSEuroOption().CallOption(50, 0.4, 0.1, 0, 2, 52)
+    assert abs(BiTreeAmericanOption().BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, N, 'call', method) - exact) < error
+
+
+def test_smoothed_lattices_need_far_fewer_steps():
+
+    lattice = BiTreeAmericanOption()
+    reference = lattice.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, 20000, 'put', 'bbsr')
+    crr = abs(lattice.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, 1000, 'put', 'crr') - reference)
+    for method in ['bbs', 'bbsr']:
+        assert abs(lattice.BiTreeAmericanOption(50, 0.4, 0.1, 2, 52, 200, 'put', method) - reference) < crr
+
+
+def test_batch_sweep_matches_the_contracts_one_by_one():
+
+    rng = np.random.default_rng(0)
+    S0, T = rng.uniform(80, 120, 20), rng.uniform(0.1, 2, 20)
+    option = np.where(rng.random(20) < 0.5, 'call', 'put')
+    lattice = BiTreeAmericanOption()
+    for method in ['crr', 'bbsr', 'lr']:
+        batch = lattice.BatchBiTreeAmericanOption(S0, 0.3, 0.05, T, 100, 200, option, method)
+        one_by_one = [lattice.BiTreeAmericanOption(s, 0.3, 0.05, t, 100, 200, o, method) for s, t, o in zip(S0, T, option)]
+        np.testing.assert_allclose(batch, one_by_one, rtol=1e-12)
+
+
+def test_a_set_cancel_event_stops_the_lattice():
+
+    from MCEngine import SimulationCancelled
+    cancel = threading.Event()
+    assert _price(cancel=cancel) == _price()
+    cancel.set()
+    with pytest.raises(SimulationCancelled):
+        _price(cancel=cancel)
@@ -0,0 +1,56 @@
+"""
+Tests of the implied volatility solvers: python -m pytest test_ImpliedVolatility.py
+"""
+import warnings
+import numpy as np
+import pytest
+from BSEuroOption import BSEuroOption
+from ImpliedVolatility import BatchImpliedVolatility, ImpliedVolatility
+
+
+def _chain(strikes, sigma, T=1.0, S=100.0, r=0.05, q=0.01):
+
+    # the premiums of calls and puts of every strike, priced at volatility sigma
+    K = np.concatenate([strikes, strikes])
+    option = np.repeat(['call', 'put'], len(strikes))
+    call, put = BSEuroOption().CallAndPutOption(S, sigma, r, q, T, K)
+    return K, np.where(option == 'call', call, put), option
+
+
+@pytest.mark.parametrize('method', ['newton', 'bracketed'])
+def test_chain_round_trip(method):
+
+    K, V, option = _chain(np.linspace(80, 120, 9), 0.25)
+    sigma = BatchImpliedVolatility(100.0, 0.05, 0.01, 1.0, K, V, option).Volatility(method=method)
+    np.testing.assert_allclose(sigma, 0.25, rtol=1e-8)
+
+
+def test_bracketed_solver_converges_far_from_the_money():
+
+    # deep in and out of the money, short and long expiries, where Newton from SigmaInit diverges
+    for T, sigma in [(0.02, 0.1), (0.25, 0.8), (5.0, 1.5)]:
+        K, V, option = _chain(np.array([20.0, 60.0, 100.0, 150.0, 400.0]), sigma, T)
+        solved = BatchImpliedVolatility(100.0, 0.05, 0.01, T, K, V, option).Volatility(method='bracketed')
+        # the premiums of the deepest contracts carry a few significant digits of time value at most
+        inside = V - np.maximum(np.where(option == 'call', 1, -1)*(100*np.exp(-0.01*T) - K*np.exp(-0.05*T)), 0) > 1e-8
+        np.testing.assert_allclose(solved[inside], sigma, rtol=1e-5)
+
+
+@pytest.mark.parametrize('method', ['newton', 'bracketed'])
+def test_quotes_without_an_implied_volatility_give_nan(method):
+
+    # expired (T = 0), worthless (V = 0), below the intrinsic value and above the spot price
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        sigma = BatchImpliedVolatility(100.0, 0.05, 0.0, [0.0, 1.0, 1.0, 1.0], [100.0, 100.0, 50.0, 100.0],
+                                       [10.0, 0.0, 40.0, 150.0], 'call').Volatility(method=method)
+    assert np.all(np.isnan(sigma))
+
+
+def test_scalar_solvers_match_the_batch():
+
+    call, put = BSEuroOption().CallAndPutOption(100.0, 0.3, 0.05, 0.0, 1.0, 110.0)
+    for method in ['newton', 'bracketed']:
+        assert ImpliedVolatility(100, 0.05, 0, 1, 110, float(call)).CallVolatility(method=method) == pytest.approx(0.3)
+        assert ImpliedVolatility(100, 0.05, 0, 1, 110, float(put)).PutVolatility(method=method) == pytest.approx(0.3)
+    assert np.isnan(ImpliedVolatility(100, 0.05, 0, 0, 100, 10).CallVolatility(method='bracketed'))
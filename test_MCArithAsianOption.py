@@ -0,0 +1,61 @@
+"""
+Tests of the Monte Carlo arithmetic Asian option pricer: python -m pytest test_MCArithAsianOption.py
+"""
+import numpy as np
+import pytest
+from MCArithAsianOption import MCArithAsianOption
+
+
+def _option(**inputs):
+
+    return MCArithAsianOption(**dict(dict(s0=100, sigma=0.3, r=0.05, T=1, K=100, n=12, m=200000,
+                                          option_type='call'), **inputs))
+
+
+def test_pathwise_greeks_match_bump_and_reprice():
+
+    # bumped with the same seed, so the paths are the same and the differences are not swamped by the noise
+    price = lambda **inputs: _option(**inputs).pricing()[0]
+    greeks = _option().greeks()
+    np.testing.assert_allclose(greeks['delta'], (price(s0=100.5) - price(s0=99.5)), rtol=1e-2)
+    np.testing.assert_allclose(greeks['vega'], (price(sigma=0.305) - price(sigma=0.295))/0.01, rtol=1e-2)
+    np.testing.assert_allclose(greeks['rho'], (price(r=0.055) - price(r=0.045))/0.01, rtol=1e-2)
+    # the likelihood ratio gamma is the noisiest estimator
+    np.testing.assert_allclose(greeks['gamma'], price(s0=101) - 2*price() + price(s0=99), rtol=0.1)
+
+
+@pytest.fixture(scope='module')
+def reference():
+
+    # a randomized QMC price with all the controls, its confidence interval a hundred times narrower than the tests'
+    return _option(n=16, m=2**16, sampling='sobol', controls=['geometric', 'terminal', 'average']).pricing()[0]
+
+
+@pytest.mark.parametrize('modes, reduction', [({}, 1), ({'antithetic': True}, 1.2), ({'moment_matching': True}, 1),
+                                              ({'ctrl_var': True}, 100),
+                                              ({'controls': ['geometric', 'terminal', 'average']}, 100),
+                                              ({'antithetic': True, 'moment_matching': True, 'ctrl_var': True}, 100)])
+def test_variance_reduction_modes_are_unbiased(reference, modes, reduction):
+
+    option = _option(n=16, m=50000, **modes)
+    price, (low, high) = option.pricing()
+    assert abs(price - reference) < 4 * (high - low) / 3.92
+    assert option.variance_reduction >= reduction
+
+
+@pytest.mark.parametrize('m, modes', [(10001, {}), (10002, {'antithetic': True})])
+def test_moment_matching_leaves_a_single_row_chunk_as_drawn(m, modes):
+
+    # the last chunk holds one path (one antithetic pair), with no spread to match
+    price, _ = _option(n=50, m=m, chunk_size=10000, moment_matching=True, **modes).pricing()
+    assert np.isfinite(price)
+
+
+def test_sobol_sampling(reference):
+
+    pseudo, (low, high) = _option(n=16, m=2**16).pricing()
+    sobol, (sobol_low, sobol_high) = _option(n=16, m=2**16, sampling='sobol').pricing()
+    assert low < sobol < high
+    assert (sobol_high - sobol_low) < (high - low) / 10
+    assert _option(n=16, m=2**16, sampling='sobol').pricing()[0] == sobol
+    assert _option(n=16, m=2**16, sampling='sobol', seed=1).pricing()[0] != sobol
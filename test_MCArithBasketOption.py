@@ -0,0 +1,46 @@
+"""
+Tests of the Monte Carlo arithmetic basket option pricer: python -m pytest test_MCArithBasketOption.py
+"""
+import numpy as np
+from MCArithBasketOption import MCArithBasketOption
+
+S0 = np.array([100.0, 95.0, 90.0])
+SIGMA = np.array([0.3, 0.25, 0.2])
+CORR = np.array([[1, 0.5, 0.2], [0.5, 1, 0.3], [0.2, 0.3, 1]])
+
+
+def _option(**inputs):
+
+    return MCArithBasketOption(**dict(dict(s0=S0, sigma=SIGMA, corr=CORR, r=0.05, T=1, K=95, m=200000,
+                                           option_type='put'), **inputs))
+
+
+def test_pathwise_greeks_match_bump_and_reprice():
+
+    # bumped with the same seed, so the paths are the same and the differences are not swamped by the noise
+    price = lambda **inputs: _option(**inputs).pricing()[0]
+    greeks = _option().greeks()
+    for i in range(len(S0)):
+        bump = np.eye(len(S0))[i]
+        np.testing.assert_allclose(greeks['delta'][i], (price(s0=S0 + 0.5*bump) - price(s0=S0 - 0.5*bump)),
+                                   rtol=1e-2)
+        np.testing.assert_allclose(greeks['vega'][i],
+                                   (price(sigma=SIGMA + 0.005*bump) - price(sigma=SIGMA - 0.005*bump))/0.01,
+                                   rtol=1e-2)
+    np.testing.assert_allclose(greeks['rho'], (price(r=0.055) - price(r=0.045))/0.01, rtol=1e-2)
+
+
+def test_moment_matching_leaves_a_single_row_chunk_as_drawn():
+
+    # the last chunk holds one path, with no spread to match
+    price, _ = MCArithBasketOption(s0_1=100, s0_2=100, sigma_1=0.3, sigma_2=0.3, r=0.05, T=3, K=100, rho=0.5,
+                                   option_type='call', m=10001, chunk_size=10000, moment_matching=True).pricing()
+    assert np.isfinite(price)
+
+
+def test_sobol_sampling_of_an_averaged_basket():
+
+    pseudo, (low, high) = _option(n=12, m=2**15).pricing()
+    sobol, (sobol_low, sobol_high) = _option(n=12, m=2**15, sampling='sobol').pricing()
+    assert low < sobol < high
+    assert (sobol_high - sobol_low) < (high - low) / 3
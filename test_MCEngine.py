@@ -0,0 +1,40 @@
+"""
+Tests of the chunked Monte Carlo engine: python -m pytest test_MCEngine.py
+"""
+import numpy as np
+import pytest
+from MCEngine import BrownianBridge, run_adaptive, run_batches, run_qmc
+
+
+def _payoffs(Z):
+
+    return np.column_stack([Z[:, 0], Z[:, 0]**2])
+
+
+@pytest.mark.parametrize('m', [0, -5])
+def test_no_paths_is_an_error(m):
+
+    simulate = lambda rng, size: _payoffs(rng.standard_normal((size, 1)))
+    with pytest.raises(ValueError, match='m must be positive'):
+        run_batches(simulate, m, 100, 0)
+    with pytest.raises(ValueError, match='m must be positive'):
+        run_adaptive(simulate, lambda acc: (0, (0, 0)), m, 100, 0)
+    with pytest.raises(ValueError, match='m must be positive'):
+        run_qmc(_payoffs, lambda U: U, 1, m, 100, 0, 4)
+
+
+def test_chunks_merge_to_the_moments_of_all_paths():
+
+    acc = run_batches(lambda rng, size: _payoffs(rng.standard_normal((size, 1))), 100001, 10000, 0)
+    assert acc.count == 100001
+    assert abs(acc.mean[0]) < 0.02 and abs(acc.mean[1] - 1) < 0.02
+
+
+@pytest.mark.parametrize('n', [1, 2, 7, 16, 100])
+def test_brownian_bridge_gives_independent_unit_increments(n):
+
+    # the increments are a linear map A of the normals: i.i.d. N(0, 1) increments need A A^T = I
+    A = BrownianBridge(n).increments(np.eye(n))
+    np.testing.assert_allclose(A.T @ A, np.eye(n), atol=1e-12)
+    # the first normal alone fixes the terminal value W(n) = sqrt(n) Z_0
+    np.testing.assert_allclose(A[0].sum(), np.sqrt(n))
@@ -0,0 +1,80 @@
+"""
+Tests of the price cache: python -m pytest test_PriceCache.py
+"""
+import numpy as np
+from BatchPricer import cache_keys
+from CFGeoAsianOption import GeoAsianOption
+from CFGeoBasketOption import CFGeoBasketOption
+from PriceCache import CachedGeoAsianOption, CachedGeoBasketOption, PriceCache
+
+
+def test_keys_are_normalized():
+
+    cache = PriceCache()
+    assert cache.key('asian', 0.3, 100) == cache.key('asian', 0.3 + 1e-15, 100.0)
+    assert cache.key('asian', 0.3, 100) != cache.key('asian', 0.3001, 100)
+    # the scalar and the batch keys agree, and a missing input keys equal to itself
+    assert cache.keys('asian', [np.array([0.3, np.nan]), np.array([100, 100])]) == \
+        [cache.key('asian', 0.3, 100), cache.key('asian', float('nan'), 100)]
+
+
+def test_book_columns_are_normalized_per_product():
+
+    cache = PriceCache()
+    american = {'product': 'american', 'S': 100, 'sigma': 0.3, 'r': 0.05, 'T': 1, 'K': 100, 'option_type': 'put'}
+    rows = [american, dict(american, sigma='0.30', option_type=' Put'), dict(american, sigma='0.3', N='500')]
+    assert len(set(cache_keys(cache, 'american', rows))) == 1
+    basket = {'product': 'arith_basket', 's0': '100;95', 'sigma': '0.3;0.25', 'corr': '0.5', 'r': 0.05, 'T': 1,
+              'K': 100, 'ctrl_var': 'true'}
+    rows = [basket, dict(basket, s0=[100.0, 95.0], sigma='0.30;0.250', ctrl_var='Yes'), dict(basket, s0='100;96')]
+    keys = cache_keys(cache, 'arith_basket', rows)
+    assert keys[0] == keys[1] != keys[2]
+
+
+def test_lru_eviction_and_ttl_expiry():
+
+    now = [0.0]
+    cache = PriceCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    for name in ['a', 'b', 'a', 'c']:
+        cache.get(cache.key(name), lambda: name)
+    # 'b' was the least recently used when 'c' came in
+    assert cache.get(cache.key('a'), lambda: 'priced again') == 'a'
+    assert cache.get(cache.key('b'), lambda: 'priced again') == 'priced again'
+    now[0] = 20.0
+    assert cache.get(cache.key('b'), lambda: 'expired') == 'expired'
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 5, 'evictions': 2, 'expirations': 1,
+                             'hit_rate': 2/7}
+
+
+def test_a_batch_prices_its_distinct_misses_once():
+
+    cache = PriceCache()
+    priced = []
+
+    def compute(miss):
+        priced.append(miss.tolist())
+        return K[miss] * 2
+
+    K = np.array([80.0, 90.0, 80.0, 100.0])
+    np.testing.assert_array_equal(cache.get_many(cache.keys('double', [K]), compute), K * 2)
+    K = np.array([90.0, 110.0, 110.0])
+    np.testing.assert_array_equal(cache.get_many(cache.keys('double', [K]), compute), K * 2)
+    assert priced == [[0, 1, 3], [1]]
+
+
+def test_cached_pricers_give_the_prices_of_the_pricers():
+
+    cache = PriceCache()
+    for _ in range(2):
+        assert CachedGeoAsianOption(cache, 100, 0.3, 0.05, 3, 100, 50).GreeksGeoAsian('put') == \
+            GeoAsianOption(100, 0.3, 0.05, 3, 100, 50).GreeksGeoAsian('put')
+    basket = dict(s0=np.array([100.0, 95.0, 90.0]), sigma=np.array([0.3, 0.25, 0.2]), corr=np.eye(3), r=0.05, T=1,
+                  K=95, n=12)
+    greeks = CachedGeoBasketOption(cache, **basket).GreeksGeoBasket('call')
+    # the Greeks are copies, altering them leaves the cache untouched
+    greeks['delta'][:] = 0
+    np.testing.assert_array_equal(CachedGeoBasketOption(cache, **basket).GreeksGeoBasket('call')['delta'],
+                                  CFGeoBasketOption(**basket).GreeksGeoBasket('call')['delta'])
+    assert CachedGeoBasketOption(cache, **basket).GreeksGeoBasket('put')['price'] == \
+        CFGeoBasketOption(**basket).GreeksGeoBasket('put')['price']
+    assert cache.hits == 2
@@ -0,0 +1,89 @@
+"""
+Tests of the pricing service on localhost: python -m pytest test_PricingServer.py
+"""
+import asyncio
+import numpy as np
+import BatchPricer
+import PricingServer as server_module
+from PriceCache import PriceCache
+from PricingServer import PricingServer, request
+
+TRADE = {'product': 'european', 'S': 100, 'sigma': 0.3, 'r': 0.05, 'T': 1, 'K': 100, 'option_type': 'put'}
+
+
+def serve(session, **server_args):
+
+    # run session(server, reader, writer) against a server on a free port
+    async def main():
+        server = PricingServer(workers=1, **server_args)
+        await server.start()
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        try:
+            return await session(server, reader, writer)
+        finally:
+            writer.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_are_coalesced():
+
+    async def session(server, reader, writer):
+        trades = [dict(TRADE, K=K) for K in range(80, 120)]
+        results = await asyncio.gather(*(server.price(trade) for trade in trades))
+        return trades, results, server.batches
+
+    trades, results, batches = serve(session, window=0.05)
+    assert batches == 1
+    np.testing.assert_array_equal([result['value'] for result in results],
+                                  BatchPricer.price_chunk(trades)[:, 0])
+
+
+def test_a_bad_trade_of_a_list_answers_its_own_error():
+
+    async def session(server, reader, writer):
+        return (await request(reader, writer, [TRADE, dict(TRADE, product='swap'), 5, dict(TRADE, option_type=1)]),
+                await request(reader, writer, dict(TRADE, product='swap')))
+
+    (status, results), (single, error) = serve(session)
+    assert status == 200
+    assert results[0]['value'] > 0
+    assert results[1] == {'error': "unknown product 'swap'"}
+    assert 'error' in results[2]
+    assert results[3] == {'value': None, 'conf_low': None, 'conf_high': None}
+    # a single trade still answers a 400
+    assert single == 400 and error == {'error': "unknown product 'swap'"}
+
+
+def test_a_batch_that_raises_is_priced_trade_by_trade(monkeypatch):
+
+    def price_chunk(rows, cache=None):
+        if any(row['K'] == 'raise' for row in rows):
+            raise RuntimeError('engine failure')
+        return BatchPricer.price_chunk(rows, cache=cache)
+
+    monkeypatch.setattr(server_module, 'price_chunk', price_chunk)
+
+    async def session(server, reader, writer):
+        return await request(reader, writer, [TRADE, dict(TRADE, K='raise'), dict(TRADE, K=90)])
+
+    status, results = serve(session, window=0.05)
+    assert status == 200
+    assert results[1] == {'error': 'engine failure'}
+    assert results[0]['value'] == BatchPricer.price_chunk([TRADE])[0, 0]
+    assert results[2]['value'] == BatchPricer.price_chunk([dict(TRADE, K=90)])[0, 0]
+
+
+def test_cached_pooled_trades_are_answered_on_the_loop():
+
+    american = dict(TRADE, product='american', N=100)
+
+    async def session(server, reader, writer):
+        first = await request(reader, writer, [american, dict(american, K=90)])
+        again = await request(reader, writer, [dict(american, K='90.0'), dict(american, sigma='0.30')])
+        return first, again, server.cache.stats()
+
+    (_, first), (_, again), stats = serve(session, cache=PriceCache())
+    assert again == first[::-1]
+    assert stats['misses'] == 2 and stats['hits'] == 2
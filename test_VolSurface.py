@@ -0,0 +1,56 @@
+"""
+Tests of the implied volatility surface: python -m pytest test_VolSurface.py
+"""
+import numpy as np
+from BSEuroOption import BSEuroOption
+from VolSurface import VolSurface
+
+EXPIRIES = np.array([0.25, 0.5, 1.0, 2.0])
+STRIKES = np.array([80.0, 90.0, 100.0, 110.0, 120.0])
+
+
+def _smile(T, K):
+
+    return 0.2 + 0.1*(np.log(K/100))**2 + 0.02*T
+
+
+def _quotes(T, K, S=100.0, r=0.05, q=0.01):
+
+    # calls above the spot and puts below, priced on the smile
+    T, K = np.broadcast_arrays(T, K)
+    option = np.where(K >= S, 'call', 'put')
+    call, put = BSEuroOption().CallAndPutOption(S, _smile(T, K), r, q, T, K)
+    return T.ravel(), K.ravel(), np.where(option == 'call', call, put).ravel(), option.ravel()
+
+
+def test_the_quotes_are_recovered_on_the_grid():
+
+    surface = VolSurface(100.0, 0.05, 0.01, *_quotes(EXPIRIES[:, None], STRIKES))
+    np.testing.assert_allclose(surface.grid, _smile(EXPIRIES[:, None], STRIKES), rtol=1e-8)
+    np.testing.assert_allclose(surface.sigma(EXPIRIES[:, None], STRIKES), _smile(EXPIRIES[:, None], STRIKES),
+                               rtol=1e-8)
+    assert surface.sigma(1.0, 100.0) == surface.sigma(1.0, 100.0) == surface.sigma(np.array(1.0), np.array(100.0))
+
+
+def test_total_variance_is_interpolated_linearly_in_strike_and_in_expiry():
+
+    surface = VolSurface(100.0, 0.05, 0.01, *_quotes(EXPIRIES[:, None], STRIKES))
+    np.testing.assert_allclose(surface.sigma(1.0, 95.0), np.sqrt((_smile(1.0, 90.0)**2 + _smile(1.0, 100.0)**2)/2),
+                               rtol=1e-8)
+    variance = (_smile(1.0, 100.0)**2*1.0 + _smile(2.0, 100.0)**2*2.0)/2
+    np.testing.assert_allclose(surface.sigma(1.5, 100.0), np.sqrt(variance/1.5), rtol=1e-8)
+    # flat beyond the grid
+    np.testing.assert_allclose(surface.sigma([0.1, 5.0], [50.0, 200.0]), [_smile(0.25, 80.0), _smile(2.0, 120.0)],
+                               rtol=1e-8)
+
+
+def test_update_extends_the_grid_and_refreshes_the_cache():
+
+    surface = VolSurface(100.0, 0.05, 0.01, *_quotes(EXPIRIES[:, None], STRIKES))
+    before = surface.sigma(1.0, 105.0)
+    surface.update(*_quotes(1.0, 105.0))
+    assert surface.strikes.tolist() == [80.0, 90.0, 100.0, 105.0, 110.0, 120.0]
+    assert surface.sigma(1.0, 105.0) != before
+    np.testing.assert_allclose(surface.sigma(1.0, 105.0), _smile(1.0, 105.0), rtol=1e-8)
+    # the new strike is a hole on the other expiries, filled along the strikes
+    np.testing.assert_allclose(surface.sigma(2.0, 105.0), (_smile(2.0, 100.0) + _smile(2.0, 110.0))/2, rtol=1e-8)